@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Benchmarks of the main operations of the archive on synthetic data.
+#
+# Run `python benchmarks/bench.py --help` for the available options.
+# Results are written as JSON so that they can be compared between commits
+# with `benchmarks/compare.py`.
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Benchmark the working copy rather than an installed version
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from infocards.archive import Archive
+from infocards.models import _db_proxy, MODELS
+
+
+def _commit():
+    """ Obtain the hash of the commit being benchmarked, if any. """
+    try:
+        out = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT)
+
+        return out.decode().strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentiles(samples):
+    """ Summarize a list of durations (in seconds) in milliseconds. """
+    samples = sorted(samples)
+
+    def at(p):
+        return round(samples[min(len(samples) - 1,
+            int(p / 100 * len(samples)))] * 1000, 3)
+
+    return {
+        'count': len(samples),
+        'mean': round(sum(samples) / len(samples) * 1000, 3),
+        'p50': at(50),
+        'p90': at(90),
+        'p99': at(99),
+        'max': round(samples[-1] * 1000, 3)
+    }
+
+
+def _timed(func, *args, **kwargs):
+    """ Run a function, returning its result and duration in seconds. """
+    start = time.time()
+    result = func(*args, **kwargs)
+
+    return result, time.time() - start
+
+
+class Corpus(object):
+
+    def __init__(self, cards, sections, tags, content, seed):
+        """ Synthetic data to fill the archive with.
+
+            cards    -- number of cards
+            sections -- number of sections
+            tags     -- size of the tag vocabulary
+            content  -- number of words of the content of each card
+            seed     -- seed of the random generator
+        """
+        self.random = random.Random(seed)
+        self.words = ['w%04d' % i for i in range(5000)]
+        self.tags = ['tag%03d' % i for i in range(tags)]
+        self.content = content
+
+        self.cards = [self.card(i) for i in range(cards)]
+        self.sections = ['section %d' % i for i in range(sections)]
+
+    def card(self, i):
+        """ Generate the attributes of a card. """
+        pick = self.random.sample
+
+        return {
+            'title': 'card %d %s' % (i, ' '.join(pick(self.words, 3))),
+            'desc': ' '.join(pick(self.words, 8)),
+            'content': ' '.join(
+                self.random.choice(self.words) for _ in range(self.content)),
+            'tags': ' '.join(pick(self.tags, min(4, len(self.tags))))
+        }
+
+    def queries(self, count):
+        """ Generate search queries made of words present in the cards,
+            some of them slightly misspelled.
+        """
+        queries = []
+
+        for _ in range(count):
+            words = self.random.sample(self.words, 2)
+
+            if self.random.random() < 0.3:
+                words[0] = words[0][:-1]
+
+            queries.append(' '.join(words))
+
+        return queries
+
+
+def open_archive(backend, params):
+    """ Open an empty archive for a backend.
+
+        Returns a tuple with the archive and a cleanup function.
+    """
+    if backend == 'sqlite':
+        path = tempfile.mkdtemp()
+        params = dict(params, db_type='sqlite',
+            db_name=os.path.join(path, 'bench.db'))
+
+        def cleanup():
+            shutil.rmtree(path, ignore_errors=True)
+
+        return Archive(**params), cleanup
+
+    params = dict(params, db_type=backend)
+
+    # Start from scratch on existing databases
+    archive = Archive(**params)
+
+    with _db_proxy.bind(archive.db):
+        archive.db.drop_tables(MODELS, safe=True)
+
+    archive.close()
+
+    return Archive(**params), lambda: None
+
+
+def bench_insert(archive, corpus, single):
+    """ Time the creation of the cards, one by one and in bulk. """
+    cards = corpus.cards[:single]
+    durations = []
+
+    for attrs in cards:
+        _, elapsed = _timed(archive.new_card, author='bench', **attrs)
+        durations.append(elapsed)
+
+    (ids, _), elapsed = _timed(
+        archive.bulk_new_cards, corpus.cards[single:], author='bench')
+
+    bulk = len(corpus.cards) - single
+
+    return {
+        'new_card': _percentiles(durations),
+        'new_card_per_second': round(len(durations) / sum(durations), 1),
+        'bulk_new_cards': {
+            'count': bulk,
+            'seconds': round(elapsed, 3),
+            'per_second': round(bulk / elapsed, 1) if elapsed else None
+        }
+    }
+
+
+def bench_relations(archive, corpus):
+    """ Time the creation and traversal of card-section relations. """
+    sids, _ = archive.bulk_new_sections(corpus.sections)
+
+    relations = [
+        (card.id, corpus.random.choice(sids))
+        for card in archive.cards() for _ in range(2)]
+
+    (added, _), elapsed = _timed(archive.bulk_add_to_sections, relations)
+
+    def lazy():
+        return sum(len(list(s.cards())) for s in archive.sections())
+
+    def prefetched():
+        return sum(
+            len(list(s.cards())) for s in archive.sections(prefetch_cards=True))
+
+    def card_sections():
+        return sum(len(list(c.sections())) for c in archive.cards(limit=500))
+
+    return {
+        'bulk_add_to_sections': {
+            'count': len(added),
+            'seconds': round(elapsed, 3)
+        },
+        'section_cards_lazy_seconds': round(_timed(lazy)[1], 3),
+        'section_cards_prefetched_seconds': round(_timed(prefetched)[1], 3),
+        'card_sections_500_seconds': round(_timed(card_sections)[1], 3)
+    }
+
+
+def bench_search(archive, corpus, queries):
+    """ Time searches, both full and ranked, and tag filters. """
+    search = []
+    ranked = []
+    results = 0
+
+    for query in corpus.queries(queries):
+        cards, elapsed = _timed(lambda: list(archive.search(query)))
+        search.append(elapsed)
+        results += len(cards)
+
+        _, elapsed = _timed(archive.search_ranked, query, limit=20)
+        ranked.append(elapsed)
+
+    tags = []
+
+    for _ in range(queries):
+        wanted = corpus.random.sample(corpus.tags, min(2, len(corpus.tags)))
+        _, elapsed = _timed(
+            lambda: list(archive.cards_by_tags(all_of=wanted)))
+        tags.append(elapsed)
+
+    return {
+        'search': _percentiles(search),
+        'search_mean_results': round(results / queries, 1),
+        'search_ranked': _percentiles(ranked),
+        'cards_by_tags': _percentiles(tags)
+    }
+
+
+def bench_contention(archive, corpus, readers, seconds):
+    """ Measure the throughput of several threads reading random cards
+        (including their content) while another one modifies random cards.
+    """
+    ids = [card.id for card in archive.cards()]
+    deadline = time.time() + seconds
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def read(rnd):
+        archive.get_card(cid=rnd.choice(ids)).content
+
+    def write(rnd):
+        archive.modify_card(
+            cid=rnd.choice(ids), desc=' '.join(rnd.sample(corpus.words, 8)),
+            author='bench')
+
+    def work(name, operation, seed):
+        rnd = random.Random(seed)
+        done = errors = 0
+
+        while time.time() < deadline:
+            try:
+                operation(rnd)
+                done += 1
+
+            except Exception:
+                errors += 1
+
+        with lock:
+            counts[name] += done
+            counts['errors'] += errors
+
+    threads = [
+        threading.Thread(target=work, args=('reads', read, i))
+        for i in range(readers)]
+    threads.append(threading.Thread(target=work, args=('writes', write, -1)))
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return {
+        'readers': readers,
+        'seconds': seconds,
+        'reads_per_second': round(counts['reads'] / seconds, 1),
+        'writes_per_second': round(counts['writes'] / seconds, 1),
+        'errors': counts['errors']
+    }
+
+
+def bench_memory(archive):
+    """ Measure the memory allocated while iterating over every card. """
+    if tracemalloc is None:
+        return None
+
+    gc.collect()
+    tracemalloc.start()
+
+    count = sum(1 for _ in archive.cards())
+    _, peak = tracemalloc.get_traced_memory()
+
+    tracemalloc.stop()
+
+    return {
+        'cards': count,
+        'iterate_cards_peak_kb': round(peak / 1024, 1)
+    }
+
+
+def run(backend, params, args):
+    """ Run every benchmark on a backend.
+
+        Returns a dict with the results.
+    """
+    corpus = Corpus(args.cards, args.sections, args.tags, args.content,
+        args.seed)
+
+    try:
+        archive, cleanup = open_archive(backend, params)
+
+    except Exception as e:
+        return {'skipped': str(e)}
+
+    try:
+        results = {}
+        results['insert'] = bench_insert(
+            archive, corpus, min(args.single, len(corpus.cards)))
+        results['relations'] = bench_relations(archive, corpus)
+        results['search'] = bench_search(archive, corpus, args.queries)
+        results['memory'] = bench_memory(archive)
+
+        if args.contention:
+            results['contention'] = bench_contention(
+                archive, corpus, args.readers, args.contention)
+
+        return results
+
+    finally:
+        archive.close()
+        cleanup()
+
+
+def _connection(value):
+    """ Parse connection parameters given as key=value pairs. """
+    params = {}
+
+    for pair in value.split():
+        key, _, val = pair.partition('=')
+        params[key] = int(val) if val.isdigit() else val
+
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the operations of an archive')
+    parser.add_argument('--cards', type=int, default=5000,
+        help='number of cards of the archive')
+    parser.add_argument('--sections', type=int, default=50,
+        help='number of sections of the archive')
+    parser.add_argument('--tags', type=int, default=200,
+        help='size of the tag vocabulary')
+    parser.add_argument('--content', type=int, default=100,
+        help='number of words of the content of each card')
+    parser.add_argument('--single', type=int, default=200,
+        help='number of cards created one by one, the rest are created '
+            'in bulk')
+    parser.add_argument('--queries', type=int, default=50,
+        help='number of search queries')
+    parser.add_argument('--seed', type=int, default=0,
+        help='seed of the synthetic data')
+    parser.add_argument('--contention', type=float, default=5,
+        metavar='SECONDS',
+        help='duration of the read/write contention benchmark, 0 to skip it')
+    parser.add_argument('--readers', type=int, default=4,
+        help='number of reading threads of the contention benchmark')
+    parser.add_argument('--performance', action='store_true',
+        help='use the performance mode of SQLite')
+    parser.add_argument('--postgres', type=_connection, metavar='PARAMS',
+        help='also benchmark PostgreSQL, e.g. "db_name=bench user=bench"')
+    parser.add_argument('--mysql', type=_connection, metavar='PARAMS',
+        help='also benchmark MySQL, e.g. "db_name=bench user=bench"')
+    parser.add_argument('--output', '-o',
+        help='file to write the results to, instead of the standard output')
+
+    args = parser.parse_args()
+
+    backends = [('sqlite', {'performance': args.performance})]
+
+    if args.postgres is not None:
+        backends.append(('postgres', args.postgres))
+
+    if args.mysql is not None:
+        backends.append(('mysql', args.mysql))
+
+    report = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': dict(
+            (key, getattr(args, key)) for key in
+            ('cards', 'sections', 'tags', 'content', 'single', 'queries',
+                'seed', 'contention', 'readers', 'performance')),
+        'results': dict(
+            (backend, run(backend, params, args))
+            for backend, params in backends)
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
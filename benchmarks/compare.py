@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Compare two result files of `benchmarks/bench.py`, for instance those of
+# two commits, reporting the change of every metric.
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import json
+import sys
+
+
+# Metrics describing the data rather than the performance
+_INFORMATIVE = ('.count', '.cards', '_results')
+
+
+def _flatten(results, prefix=''):
+    """ Obtain the numeric metrics of the results by their dotted path. """
+    metrics = {}
+
+    for key, value in results.items():
+        path = prefix + key
+
+        if isinstance(value, dict):
+            metrics.update(_flatten(value, path + '.'))
+
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[path] = value
+
+    return metrics
+
+
+def _higher_is_better(path):
+    """ Check whether a greater value of a metric is an improvement. """
+    return path.endswith('per_second')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare two benchmark result files')
+    parser.add_argument('base', help='results to compare against')
+    parser.add_argument('new', help='results to compare')
+    parser.add_argument('--threshold', type=float, default=10.0,
+        help='percentage of change considered a regression')
+
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = _flatten(json.load(f)['results'])
+
+    with open(args.new) as f:
+        new = _flatten(json.load(f)['results'])
+
+    regressions = 0
+
+    for path in sorted(set(base) & set(new)):
+        old, value = base[path], new[path]
+
+        if path.endswith(_INFORMATIVE) or not old:
+            continue
+
+        change = (value - old) / old * 100
+        worse = -change if _higher_is_better(path) else change
+        mark = ''
+
+        if worse > args.threshold:
+            mark = '  REGRESSION'
+            regressions += 1
+
+        print('%-60s %12s %12s %+8.1f%%%s' % (path, old, value, change, mark))
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
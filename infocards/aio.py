@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This module contains the asyncio interface of the archive, which requires
+# Python 3.6 or later and is therefore not imported by the package
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import itertools
+import threading
+from .archive import Archive
+from .exceptions import ArchiveConfigException
+
+
+def _loaded(card):
+    """ Fetch the content of a card, if any, so that accessing it later
+        does not query the database.
+
+        Returns the card.
+    """
+    if card is not None:
+        card.content
+
+    return card
+
+
+def _take(items, size):
+    """ Obtain the next items of an iterator, at most `size` of them. """
+    return list(itertools.islice(items, size))
+
+
+class AsyncArchive(object):
+
+    def __init__(self, archive=None, max_workers=10, max_searches=2,
+        chunk_size=100, **kwargs):
+        """ Asynchronous interface to an archive.
+
+            archive      -- Archive to use. If not provided, one is created
+                with the rest of the parameters
+            max_workers  -- maximum number of threads performing operations
+                on the database at the same time
+            max_searches -- maximum number of searches running at the same
+                time, so that they cannot take all the threads
+            chunk_size   -- number of cards or sections obtained at a time
+                by the asynchronous generators
+
+            Operations are run in a pool of threads, each of them using its
+            own connection to the database, so the event loop is never
+            blocked waiting for the database or comparing search terms.
+        """
+        if archive is None:
+            if kwargs.get('db_name') in ('', ':memory:'):
+                raise ArchiveConfigException(
+                    'In-memory archives cannot be shared between threads')
+
+            archive = Archive(**kwargs)
+
+            # The archive is only used from the thread pool from now on
+            if not archive.db.is_closed():
+                archive.db.close()
+
+        self.archive = archive
+        self.chunk_size = chunk_size
+        self.max_searches = max_searches
+        self.max_workers = max_workers
+
+        self._executor = ThreadPoolExecutor(max_workers)
+
+        # Created on first use, within the running event loop
+        self._search_limit = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _close_connection(self, barrier):
+        """ Close the connection of the current thread of the pool, if
+            open, then wait for the rest of the threads to do the same, so
+            that each thread runs this exactly once.
+        """
+        if not self.archive.db.is_closed():
+            self.archive.db.close()
+
+        barrier.wait()
+
+    async def _iterate(self, method, *args, **kwargs):
+        """ Iterate over a generator of the archive, obtaining its items in
+            chunks from the thread pool.
+
+            Returns an asynchronous generator.
+        """
+        items = method(*args, **kwargs)
+
+        while True:
+            chunk = await self._run(_take, items, self.chunk_size)
+
+            if not chunk:
+                return
+
+            for item in chunk:
+                yield item
+
+    async def _run(self, method, *args, **kwargs):
+        """ Run a function in the thread pool. """
+        loop = asyncio.get_event_loop()
+
+        return await loop.run_in_executor(
+            self._executor, functools.partial(method, *args, **kwargs))
+
+    async def _search(self, method, *args, **kwargs):
+        """ Run a search in the thread pool, waiting for other searches if
+            there are too many running.
+        """
+        if self._search_limit is None:
+            self._search_limit = asyncio.Semaphore(self.max_searches)
+
+        async with self._search_limit:
+            return await self._run(method, *args, **kwargs)
+
+    async def add_card_to_section(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.add_card_to_section()`. """
+        return await self._run(
+            self.archive.add_card_to_section, *args, **kwargs)
+
+    async def bulk_add_to_sections(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.bulk_add_to_sections()`. """
+        return await self._run(
+            self.archive.bulk_add_to_sections, *args, **kwargs)
+
+    async def bulk_new_cards(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.bulk_new_cards()`. """
+        return await self._run(self.archive.bulk_new_cards, *args, **kwargs)
+
+    async def bulk_new_sections(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.bulk_new_sections()`. """
+        return await self._run(
+            self.archive.bulk_new_sections, *args, **kwargs)
+
+    async def card_content(self, card):
+        """ Obtain the content of a card, fetching it in the thread pool if
+            it was not loaded yet.
+        """
+        await self._run(_loaded, card)
+
+        return card.content
+
+    async def card_sections(self, card):
+        """ Asynchronous generator version of `CardObj.sections()`. """
+        sections = self._iterate(card.sections)
+
+        async for section in sections:
+            yield section
+
+    async def cards(self, *args, **kwargs):
+        """ Asynchronous generator version of `Archive.cards()`. """
+        cards = self._iterate(self.archive.cards, *args, **kwargs)
+
+        async for card in cards:
+            yield card
+
+    async def cards_by_tags(self, *args, **kwargs):
+        """ Asynchronous generator version of `Archive.cards_by_tags()`. """
+        cards = self._iterate(self.archive.cards_by_tags, *args, **kwargs)
+
+        async for card in cards:
+            yield card
+
+    async def cards_with_sections(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.cards_with_sections()`. """
+        return await self._run(
+            self.archive.cards_with_sections, *args, **kwargs)
+
+    async def change_seq(self):
+        """ Asynchronous version of `Archive.change_seq()`. """
+        return await self._run(self.archive.change_seq)
+
+    async def changes(self, *args, **kwargs):
+        """ Asynchronous generator version of `Archive.changes()`. """
+        changes = self._iterate(self.archive.changes, *args, **kwargs)
+
+        async for change in changes:
+            yield change
+
+    async def close(self):
+        """ Close the connections of every thread of the pool and the
+            archive, and stop the thread pool.
+
+            Connections can only be closed from the thread that opened
+            them, so every thread of the pool is given a task that closes
+            its own connection.
+        """
+        barrier = threading.Barrier(self.max_workers)
+
+        await asyncio.gather(*(
+            self._run(self._close_connection, barrier)
+            for _ in range(self.max_workers)))
+
+        await self._run(self.archive.close)
+        self._executor.shutdown(wait=True)
+
+    async def compact(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.compact()`. """
+        return await self._run(self.archive.compact, *args, **kwargs)
+
+    async def delete_card(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.delete_card()`. """
+        return await self._run(self.archive.delete_card, *args, **kwargs)
+
+    async def delete_section(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.delete_section()`. """
+        return await self._run(self.archive.delete_section, *args, **kwargs)
+
+    async def export(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.export()`. """
+        return await self._run(self.archive.export, *args, **kwargs)
+
+    async def find_duplicates(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.find_duplicates()`. """
+        return await self._run(self.archive.find_duplicates, *args, **kwargs)
+
+    async def get_card(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.get_card()`.
+
+            The content of the card is fetched beforehand as well.
+        """
+        card = await self._run(self.archive.get_card, *args, **kwargs)
+
+        return await self._run(_loaded, card)
+
+    async def get_section(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.get_section()`. """
+        return await self._run(self.archive.get_section, *args, **kwargs)
+
+    async def import_(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.import_()`. """
+        return await self._run(self.archive.import_, *args, **kwargs)
+
+    async def modify_card(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.modify_card()`. """
+        return await self._run(self.archive.modify_card, *args, **kwargs)
+
+    async def new_card(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.new_card()`. """
+        return await self._run(self.archive.new_card, *args, **kwargs)
+
+    async def new_section(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.new_section()`. """
+        return await self._run(self.archive.new_section, *args, **kwargs)
+
+    async def prune_changes(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.prune_changes()`. """
+        return await self._run(self.archive.prune_changes, *args, **kwargs)
+
+    async def reindex(self):
+        """ Asynchronous version of `Archive.reindex()`. """
+        return await self._run(self.archive.reindex)
+
+    async def remove_card_from_section(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.remove_card_from_section()`. """
+        return await self._run(
+            self.archive.remove_card_from_section, *args, **kwargs)
+
+    async def rename_section(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.rename_section()`. """
+        return await self._run(self.archive.rename_section, *args, **kwargs)
+
+    async def search(self, *args, **kwargs):
+        """ Asynchronous generator version of `Archive.search()`.
+
+            Terms are compared while obtaining the first chunk of cards,
+            which counts towards the limit of running searches.
+        """
+        results = self.archive.search(*args, **kwargs)
+        chunk = await self._search(_take, results, self.chunk_size)
+
+        while chunk:
+            for card in chunk:
+                yield card
+
+            chunk = await self._run(_take, results, self.chunk_size)
+
+    async def search_ranked(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.search_ranked()`. """
+        return await self._search(
+            self.archive.search_ranked, *args, **kwargs)
+
+    async def section_cards(self, section):
+        """ Asynchronous generator version of `SectionObj.cards()`. """
+        cards = self._iterate(section.cards)
+
+        async for card in cards:
+            yield card
+
+    async def sections(self, *args, **kwargs):
+        """ Asynchronous generator version of `Archive.sections()`. """
+        sections = self._iterate(self.archive.sections, *args, **kwargs)
+
+        async for section in sections:
+            yield section
+
+    async def similar_cards(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.similar_cards()`. """
+        return await self._run(self.archive.similar_cards, *args, **kwargs)
+
+    async def tag_counts(self, *args, **kwargs):
+        """ Asynchronous version of `Archive.tag_counts()`. """
+        return await self._run(self.archive.tag_counts, *args, **kwargs)
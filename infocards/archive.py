@@ -19,69 +19,1522 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-from __future__ import absolute_import
+from __future__ import absolute_import, division
+from contextlib import contextmanager
 from datetime import datetime
-from fuzzywuzzy import fuzz
+import functools
+import heapq
+import inspect
+import itertools
+import numbers
+import threading
 from peewee import *
+from playhouse.pool import PooledDatabase, PooledMySQLDatabase
+from playhouse.pool import PooledPostgresqlDatabase
+from .cache import LRUCache
+from .compression import get_codec
+from .dump import format_date, open_dump, parse_date, read_records
+from .dump import write_records
 from .exceptions import ArchiveConfigException, ArchiveConnectionException
 from .exceptions import ArchiveIntegrityException, ArchiveOperationException
-from .models import _db_proxy, Card, CardObj, Section, SectionObj, Relation
+from .fulltext import get_fulltext
+from .index import card_tags, card_terms, chunks, grams, lost_grams
+from .index import lost_ratio
+from .metrics import Call, count, get_sink, instrument
+from . import minhash
+from .models import _db_proxy, _LISTING, Card, CardObj, Section, SectionObj
+from .models import CardBucket, CardContent, CardSignature, CardTag, CardTerm
+from .models import Change, ChangeObj, MODELS, Relation, Tag, Term
+from .models import TermGram
+from .schema import get_setting, lock_setting, set_setting, upgrade
+from .scoring import get_scorer
+from .sqlite import PERFORMANCE_PRAGMAS, TunedSqliteDatabase, merge_pragmas
+from .tokenizers import get_tokenizer
+
+
+# Maximum number of parameters used in a single IN clause or multi-row insert
+_CHUNK_SIZE = 400
+
+# Maximum number of cards whose terms are kept for native searches
+_TERMS_CACHE_SIZE = 4096
+
+# Archive of the current worker process in parallel searches
+_worker_archive = None
+
+
+def _bound(method):
+    """ Run a method of the archive with its database bound to the models
+        in the current thread, measuring it if the archive is instrumented.
+
+        Generators are bound every time they are resumed, as they may be
+        consumed from a different thread or interleaved with the methods of
+        other archives.
+    """
+    name = method.__name__
+
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def generator(self, *args, **kwargs):
+            items = method(self, *args, **kwargs)
+            call = Call(name) if self.metrics is not None else None
+
+            try:
+                while True:
+                    with _db_proxy.bind(self.db):
+                        if call is not None:
+                            call.resume()
+
+                        try:
+                            item = next(items)
+
+                        except StopIteration:
+                            return
+
+                        finally:
+                            if call is not None:
+                                call.pause()
+
+                    yield item
+
+            finally:
+                if call is not None:
+                    self.metrics.record(call)
+
+        return generator
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with _db_proxy.bind(self.db):
+            if self.metrics is None:
+                return method(self, *args, **kwargs)
+
+            call = Call(name)
+            call.resume()
+
+            try:
+                return method(self, *args, **kwargs)
+
+            finally:
+                call.pause()
+                self.metrics.record(call)
+
+    return wrapper
+
+
+def _is_relevant(matched, total, relevance):
+    """ Check whether enough query terms were matched in a card. """
+    return int((matched / total) * 100) >= relevance
+
+
+def _match_terms_worker(config, search_terms, likelihood, id_range):
+    """ Find the indexed terms similar to the query terms within a range of
+        term ids, from a worker process.
+
+        The archive of the worker is created on its first task.
+    """
+    global _worker_archive
+
+    if _worker_archive is None:
+        _worker_archive = Archive(**config)
+
+    with _db_proxy.bind(_worker_archive.db):
+        return _worker_archive._match_terms(
+            search_terms, likelihood, id_range)
+
+
+def _push_bounded(heap, limit, item):
+    """ Push an item to a heap that keeps only the `limit` largest items. """
+    if len(heap) < limit:
+        heapq.heappush(heap, item)
+
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+
+def _writes(method):
+    """ Reject calls to a method that writes to the database when the
+        archive is read-only, instead of letting the database fail.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.read_only:
+            raise ArchiveOperationException(
+                '%s() is not available in read-only mode' % method.__name__)
+
+        return method(self, *args, **kwargs)
+
+    return wrapper
 
 
 class Archive(object):
 
-    def __init__(self, **kwargs):
-        """ Initialize the archive according to the parameters passed.
+    def __init__(self, **kwargs):
+        """ Initialize the archive according to the parameters passed.
+
+            These parameters vary from one DBMS to another, except for:
+
+            scorer      -- backend used to compare terms when searching,
+                either 'fuzzywuzzy' (default), 'rapidfuzz' or a Scorer
+                instance
+            compression -- codec used to compress the content of large
+                cards, either 'zlib', 'zstd' or a Codec instance. Content
+                is stored uncompressed in the card if not given
+            compression_threshold -- size in bytes from which the content
+                of a card is compressed and stored apart from the card,
+                defaults to 4096
+            tokenizer   -- tokenizer used to split text into search terms,
+                either 'simple' (default), 'unicode' or a Tokenizer
+                instance. The archive is reindexed when it changes
+            search_mode -- either 'index' (default), which searches through
+                the term index of the archive, or 'native', which uses the
+                full-text search of the database
+            workers     -- number of processes used to compare the query
+                terms against the term index, defaults to 1 (no parallelism)
+            search_cache     -- maximum number of search results to cache,
+                defaults to 0 (no cache)
+            search_cache_ttl -- seconds after which cached search results
+                expire, if given
+            lookup_cache     -- maximum number of cards and sections to
+                cache when obtained by id, title or name, defaults to 0
+                (no cache)
+            lookup_cache_ttl -- seconds after which cached cards and
+                sections expire, if given
+            pooled      -- whether to use a pool of connections (MySQL and
+                PostgreSQL only), defaults to False. The pool accepts the
+                `max_connections` (defaults to 20) and `stale_timeout`
+                (seconds after which idle connections are recycled)
+                parameters
+            performance -- whether to apply the pragmas of the performance
+                mode (SQLite only), defaults to False
+            metrics     -- sink to record the measurements of every call
+                to the archive to, either a Sink instance (such as
+                infocards.metrics.Stats) or a function receiving each
+                Call. Calls are not measured if not given
+            pragmas     -- dict of additional pragmas applied to every
+                connection (SQLite only), overriding those of the
+                performance mode
+            read_only   -- whether to open the archive in read-only mode
+                (SQLite only), defaults to False. The tables are not
+                created nor updated in this mode
+
+            Connections are handled per thread, so the archive may be used
+            from several threads at once.
+        """
+        cache_size = kwargs.pop('search_cache', 0)
+        cache_ttl = kwargs.pop('search_cache_ttl', None)
+
+        self.search_cache = None
+
+        if cache_size:
+            self.search_cache = LRUCache(cache_size, cache_ttl)
+
+        # Changes whenever cached results are invalidated
+        self._search_version = 0
+
+        self.metrics = get_sink(kwargs.pop('metrics', None))
+
+        lookup_size = kwargs.pop('lookup_cache', 0)
+        lookup_ttl = kwargs.pop('lookup_cache_ttl', None)
+
+        self.lookup_cache = None
+
+        if lookup_size:
+            self.lookup_cache = LRUCache(lookup_size, lookup_ttl)
+
+        # Changes whenever cached cards or sections are invalidated
+        self._lookup_version = 0
+
+        # Batch in progress in each thread, if any
+        self._batch = threading.local()
+
+        # Worker processes create their own archive with this configuration
+        self._config = dict(kwargs)
+        self._config.pop('workers', None)
+        self._pool = None
+
+        # Workers only read from the database
+        if kwargs.get('db_type') == 'sqlite':
+            self._config['read_only'] = True
+
+        self.read_only = kwargs.get('read_only', False)
+
+        self.workers = kwargs.pop('workers', 1)
+
+        if self.workers > 1 and kwargs.get('db_name') in ('', ':memory:'):
+            raise ArchiveConfigException(
+                'In-memory archives cannot be searched in parallel')
+
+        self.scorer = get_scorer(kwargs.pop('scorer', 'fuzzywuzzy'))
+
+        compression = kwargs.pop('compression', None)
+        self.compression_threshold = kwargs.pop('compression_threshold', 4096)
+        self.codec = get_codec(compression) if compression else None
+
+        self.tokenizer = get_tokenizer(kwargs.pop('tokenizer', 'simple'))
+
+        # Terms of the cards compared in native searches
+        self._terms_cache = LRUCache(_TERMS_CACHE_SIZE)
+        self.search_mode = kwargs.pop('search_mode', 'index')
+
+        if self.search_mode not in ('index', 'native'):
+            raise ArchiveConfigException(
+                'Invalid search mode: %s' % self.search_mode)
+
+        # Need to initialize the database for the models. Each archive
+        # binds its own database while its methods run, the last one
+        # created being used by the models otherwise
+        self.db = self._init_db(**kwargs)
+        _db_proxy.initialize(self.db)
+
+        if self.metrics is not None:
+            instrument(self.db)
+
+        self.fulltext = None
+
+        if self.search_mode == 'native':
+            self.fulltext = get_fulltext(kwargs['db_type'], self.db)
+
+        if self.read_only:
+            return
+
+        with _db_proxy.bind(self.db):
+            try:
+                created = Card._meta.db_table not in self.db.get_tables()
+
+                # Create tables
+                self.db.create_tables(MODELS, True)
+
+            except ImproperlyConfigured as e:
+                raise ArchiveConfigException(str(e))
+
+            # Existing archives are updated to the current schema, and those
+            # created before the term index existed (or indexed with a
+            # different tokenizer) need to be indexed
+            reindex = upgrade(self.db, created)
+
+            if not CardTerm.select().exists() and Card.select().exists():
+                reindex = True
+
+            if created:
+                set_setting('tokenizer', self.tokenizer.name)
+
+            elif get_setting('tokenizer', 'simple') != self.tokenizer.name:
+                reindex = True
+
+            if reindex:
+                self.reindex()
+
+            if self.fulltext:
+                self.fulltext.create()
+
+    def _attach_cards(self, sections):
+        """ Load the cards of several sections beforehand, using a single
+            query per chunk of sections.
+
+            Returns the list of sections.
+        """
+        by_section = dict((section.id, []) for section in sections)
+
+        for chunk in chunks(list(by_section), _CHUNK_SIZE):
+            cards = (Card
+                .select(*(_LISTING + (Relation.section.alias('section_id'),)))
+                .join(Relation)
+                .where(Relation.section << chunk)
+                .order_by(Card.id)
+                .naive())
+
+            for card in cards:
+                by_section[card.section_id].append(CardObj(card))
+
+        for section in sections:
+            section._cards = by_section[section.id]
+
+        return sections
+
+    def _attach_sections(self, cards):
+        """ Load the sections of several cards beforehand, using a single
+            query per chunk of cards.
+
+            Returns the list of cards.
+        """
+        by_card = dict((card.id, []) for card in cards)
+
+        for chunk in chunks(list(by_card), _CHUNK_SIZE):
+            sections = (Section
+                .select(Relation.card, Section.id, Section.name)
+                .join(Relation)
+                .where(Relation.card << chunk)
+                .order_by(Section.id)
+                .tuples())
+
+            for cid, sid, name in sections:
+                by_card[cid].append(SectionObj(Section(id=sid, name=name)))
+
+        for card in cards:
+            card._sections = by_card[card.id]
+
+        return cards
+
+    def _batch_ids(self):
+        """ Obtain the ids remembered by the batch in progress in the
+            current thread.
+
+            Returns a dict mapping (model, field, value) tuples to ids, or
+            None if there is no batch in progress.
+        """
+        return getattr(self._batch, 'ids', None)
+
+    def _bulk_insert(self, model, rows):
+        """ Insert rows using multi-row statements.
+
+            If a statement fails, the rows of its chunk are inserted one by
+            one so that only the offending rows are discarded.
+
+            rows -- list of (position, attrs) tuples
+
+            Returns a list of (position, error) tuples for the rows that
+            could not be inserted.
+        """
+        size = max(1, _CHUNK_SIZE // len(model._meta.fields))
+        failed = []
+
+        for chunk in chunks(rows, size):
+            try:
+                with self.db.atomic():
+                    model.insert_many([attrs for _, attrs in chunk]).execute()
+
+            except IntegrityError:
+                for position, attrs in chunk:
+                    try:
+                        with self.db.atomic():
+                            model.insert(**attrs).execute()
+
+                    except IntegrityError as e:
+                        failed.append((position, str(e)))
+
+        return failed
+
+    def _card_sections(self, cid):
+        """ Obtain the ids of the sections a card appears in. """
+        query = Relation.select(Relation.section).where(Relation.card == cid)
+
+        return [sid for sid, in query.tuples()]
+
+    def _card_terms(self, card):
+        """ Obtain the terms of a card, which are only computed again once
+            the card has been modified.
+
+            Returns a list.
+        """
+        key = (card.id, card.modified)
+        terms = self._terms_cache.get(key)
+
+        if terms is None:
+            terms = list(card_terms(card, self.tokenizer))
+            self._terms_cache.set(key, terms)
+
+        return terms
+
+    def _cards_by_id(self, ids):
+        """ Obtain the cards with the given ids, in the same order.
+
+            Returns a generator.
+        """
+        for chunk in chunks(ids, _CHUNK_SIZE):
+            cards = dict(
+                (card.id, card)
+                for card in Card.select(*_LISTING).where(Card.id << chunk))
+
+            for cid in chunk:
+                if cid in cards:
+                    yield CardObj(cards[cid])
+
+    def _clear_caches(self):
+        """ Discard every cached search result, card and section. """
+        if self.search_cache is not None:
+            self._search_version += 1
+            self.search_cache.clear()
+
+        if self.lookup_cache is not None:
+            self._lookup_version += 1
+            self.lookup_cache.clear()
+
+    def _discard_lookups(self, keys):
+        """ Remove several cards or sections from the lookup cache.
+
+            keys -- (model, field, value) tuples of the cached rows
+        """
+        if self.lookup_cache is None:
+            return
+
+        self._lookup_version += 1
+
+        for key in keys:
+            self.lookup_cache.discard(key)
+
+    def _export_records(self):
+        """ Obtain the records of the archive to export.
+
+            Sections are exported first and relations last, so that they
+            can be imported in a single pass.
+
+            Returns a generator.
+        """
+        for section in self._keyset(Section.select(), Section.id):
+            yield {'type': 'section', 'name': section.name}
+
+        cards = (Card
+            .select(Card, CardContent.codec, CardContent.data)
+            .join(CardContent, JOIN_LEFT_OUTER)
+            .naive())
+
+        for card in self._keyset(cards, Card.id):
+            content = card.content
+
+            if card.codec is not None:
+                content = get_codec(card.codec).decompress_text(card.data)
+
+            yield {
+                'type': 'card',
+                'title': card.title,
+                'desc': card.desc,
+                'content': content,
+                'tags': card.tags,
+                'modified': format_date(card.modified),
+                'modified_by': card.modified_by
+            }
+
+        for section in self._keyset(Section.select(), Section.id):
+            cards = (Card
+                .select(Card.id, Card.title)
+                .join(Relation)
+                .where(Relation.section == section.id))
+
+            for card in self._keyset(cards, Card.id):
+                yield {
+                    'type': 'relation',
+                    'card': card.title,
+                    'section': section.name
+                }
+
+    def _forget(self, field, oid, value):
+        """ Remove a card or section from the lookup cache, and from the
+            ids remembered by the current batch, after changing it.
+
+            Within a batch, the row is removed from the lookup cache once
+            the batch is committed.
+
+            field -- unique field, other than the id, by which the row can
+                also be obtained
+            oid   -- id of the row
+            value -- value of the field before the change
+        """
+        name = field.model_class.__name__
+        keys = [(name, 'id', oid), (name, field.name, value)]
+        ids = self._batch_ids()
+
+        if ids is not None:
+            for key in keys:
+                ids.pop(key, None)
+
+            # Other threads see the row unchanged until the batch commits
+            self._batch.forgotten.update(keys)
+            return
+
+        self._discard_lookups(keys)
+
+    def _forget_terms(self, terms):
+        """ Stop remembering the ids of some terms in the current batch,
+            if any, as they are no longer valid.
+        """
+        known = self._batch_ids()
+
+        if known is None:
+            return
+
+        for term in terms:
+            known.pop(('Term', 'term', term), None)
+
+    def _get_pool(self):
+        """ Obtain the process pool used for parallel searches, creating it
+            if needed.
+        """
+        if self._pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._pool = ProcessPoolExecutor(self.workers)
+
+        return self._pool
+
+    def _id_of(self, field, value):
+        """ Obtain the id of a card or section by a unique field, which is
+            remembered until the end of the current batch, if any.
+
+            Raises DoesNotExist if there is no such row.
+        """
+        ids = self._batch_ids()
+        key = (field.model_class.__name__, field.name, value)
+
+        if ids is not None and key in ids:
+            return ids[key]
+
+        oid = self._lookup(field, value).id
+
+        if ids is not None:
+            ids[key] = oid
+
+        return oid
+
+    def _index_card(self, card):
+        """ Update the search term index of a card.
+
+            Previous entries for the card are removed, so this can be used
+            both for new and modified cards.
+        """
+        self._index_cards([card])
+
+    def _index_cards(self, cards):
+        """ Update the search term index, the tags and the signatures of
+            several cards at once.
+
+            The terms of all the cards are resolved together, so that only
+            a few queries are needed regardless of the number of cards.
+        """
+        # Terms the cards used to have, which may not be used anymore
+        previous = set()
+
+        for chunk in chunks([card.id for card in cards], _CHUNK_SIZE):
+            query = (CardTerm
+                .select(CardTerm.term)
+                .where(CardTerm.card << chunk)
+                .tuples())
+
+            previous.update(tid for tid, in query)
+            CardTerm.delete().where(CardTerm.card << chunk).execute()
+
+        terms = dict(
+            (card.id, card_terms(card, self.tokenizer)) for card in cards)
+
+        vocabulary = set()
+        for words in terms.values():
+            vocabulary.update(words)
+
+        term_ids = self._term_ids(vocabulary)
+
+        rows = [
+            (cid, term) for cid in sorted(terms) for term in terms[cid]]
+
+        for chunk in chunks(rows, _CHUNK_SIZE // 2):
+            try:
+                with self.db.atomic():
+                    self._post_terms(chunk, term_ids)
+
+            except IntegrityError:
+                # Terms just resolved may have been removed by a concurrent
+                # prune, in which case they are added again
+                self._forget_terms(set(term for _, term in chunk))
+                term_ids.update(
+                    self._term_ids(set(term for _, term in chunk)))
+
+                self._post_terms(chunk, term_ids)
+
+        self._prune_terms(previous.difference(term_ids.values()))
+        self._tag_cards(cards)
+        self._sign_cards(terms)
+
+    def _index_candidates(self, matches, section):
+        """ Obtain the cards containing any of the matched terms.
+
+            matches -- matched terms, as returned by _match_terms()
+            section -- SectionObj to limit the search to, if any
+
+            Returns a dict mapping each card id to the set of ids of the
+            matched terms it contains.
+        """
+        term_ids = set()
+        for ids in matches.values():
+            term_ids.update(ids)
+
+        candidates = {}
+
+        for chunk in chunks(term_ids, _CHUNK_SIZE):
+            postings = (CardTerm
+                .select(CardTerm.card, CardTerm.term)
+                .where(CardTerm.term << chunk))
+
+            if section:
+                postings = (postings
+                    .join(Relation, on=(CardTerm.card == Relation.card))
+                    .where(Relation.section == section.id))
+
+            for cid, tid in postings.tuples():
+                candidates.setdefault(cid, set()).add(tid)
+
+        return candidates
+
+    def _index_ranked(self, search_terms, section, likelihood, relevance,
+        limit):
+        """ Rank the relevant cards through the term index.
+
+            The score of each card is computed from the scores of the matched
+            terms, and cards whose number of matched query terms cannot beat
+            the worst of the best cards found so far are skipped.
+
+            Returns a heap of (score, -card id) tuples.
+        """
+        matches = self._match_terms(search_terms, likelihood)
+        candidates = self._index_candidates(matches, section)
+        count('candidates', len(candidates))
+
+        total = len(search_terms)
+        heap = []
+
+        for cid, card_term_ids in candidates.items():
+            common = [scores for scores in matches.values()
+                if card_term_ids.intersection(scores)]
+
+            if not _is_relevant(len(common), total, relevance):
+                continue
+
+            # Best possible score, with every matched term scoring 100
+            bound = len(common) * 100 / total
+
+            if len(heap) == limit and (bound, -cid) <= heap[0]:
+                continue
+
+            score = sum(
+                max(scores[tid] for tid in card_term_ids.intersection(scores))
+                for scores in common) / total
+
+            _push_bounded(heap, limit, (score, -cid))
+
+        return heap
+
+    def _index_search(self, search_terms, section, likelihood, relevance):
+        """ Search for relevant cards through the term index.
+
+            Returns a generator.
+        """
+        # Compare the query with the vocabulary of the archive
+        matches = self._match_terms(search_terms, likelihood)
+
+        candidates = self._index_candidates(matches, section)
+        count('candidates', len(candidates))
+
+        # Check which candidates are relevant
+        relevant = []
+
+        for cid, card_term_ids in candidates.items():
+            common = [s for s, scores in matches.items()
+                if card_term_ids.intersection(scores)]
+
+            if not _is_relevant(len(common), len(search_terms), relevance):
+                continue
+
+            relevant.append(cid)
+
+        for card in self._cards_by_id(sorted(relevant)):
+            yield card
+
+    def _init_db(self, **kwargs):
+        """ Parse the arguments and initialize the proper database.
+
+            The parameters used for each database are given directly to
+            their specific connectors:
+
+            - MySQL: PyMySQL
+            - SQLite: sqlite3
+            - PostgreSQL: psycopg2
+
+            Check their documentation for more information on the available
+            parameters.
+
+            Here we only care about the database type, which could be either
+            'mysql', 'sqlite' or 'postgres'
+
+            Returns an already initialized databased.
+        """
+        db_name = kwargs.pop('db_name')
+        db_type = kwargs.pop('db_type')
+        pooled = kwargs.pop('pooled', False)
+        performance = kwargs.pop('performance', False)
+        pragmas = kwargs.pop('pragmas', {})
+        read_only = kwargs.pop('read_only', False)
+
+        if pooled and db_type not in ('mysql', 'postgres'):
+            raise ArchiveConfigException(
+                'Connection pools are only available for MySQL and PostgreSQL')
+
+        if (performance or pragmas or read_only) and db_type != 'sqlite':
+            raise ArchiveConfigException(
+                'Pragmas and read-only mode are only available for SQLite')
+
+        try:
+            if db_type == 'mysql':
+                if pooled:
+                    return PooledMySQLDatabase(db_name, **kwargs)
+
+                return MySQLDatabase(db_name, **kwargs)
+
+            elif db_type == 'postgres':
+                if pooled:
+                    return PooledPostgresqlDatabase(db_name, **kwargs)
+
+                return PostgresqlDatabase(db_name, **kwargs)
+
+            elif db_type == 'sqlite':
+                base = PERFORMANCE_PRAGMAS if performance else ()
+
+                return TunedSqliteDatabase(
+                    db_name, merge_pragmas(base, pragmas), read_only)
+
+        except OperationalError as e:
+            raise ArchiveConnectionException(str(e))
+
+        raise ArchiveConnectionException('Invalid database type')
+
+    def _invalidate_search(self, sections):
+        """ Remove the cached search results affected by a change.
+
+            sections -- ids of the sections whose results are affected, 0
+                standing for the searches in the whole archive
+
+            Within a batch, the results are removed once the batch is
+            committed.
+        """
+        if self.search_cache is None:
+            return
+
+        # Other threads see the previous results until the batch commits
+        if self._batch_ids() is not None:
+            self._batch.sections.update(sections)
+            return
+
+        sections = set(sections)
+        self._search_version += 1
+
+        self.search_cache.evict(lambda key: key[1] in sections)
+
+    def _keyset(self, query, field, size=1000, after=None, limit=None):
+        """ Iterate over the rows of a query in pages ordered by a unique
+            field, so that no page needs an offset or a long-running cursor.
+
+            Returns a generator.
+        """
+        for page in self._keyset_pages(query, field, size, after, limit):
+            for row in page:
+                yield row
+
+    def _keyset_pages(self, query, field, size=1000, after=None,
+        limit=None):
+        """ Fetch the rows of a query in pages ordered by a unique field.
+
+            after -- only fetch the rows whose field is greater than this
+            limit -- maximum number of rows to fetch. All of them are
+                fetched if not provided
+
+            Returns a generator of lists of rows.
+        """
+        last = after
+
+        while limit is None or limit > 0:
+            count = size if limit is None else min(size, limit)
+            page = query.order_by(field).limit(count)
+
+            if last is not None:
+                page = page.where(field > last)
+
+            rows = list(page)
+
+            if rows:
+                yield rows
+
+            if len(rows) < count:
+                return
+
+            if limit is not None:
+                limit -= len(rows)
+
+            last = getattr(rows[-1], field.name)
+
+    def _log_changes(self, kind, action, rows):
+        """ Record changes in the change log, within the transaction that
+            performs them.
+
+            kind   -- kind of the changed rows: 'card', 'section' or
+                'relation'
+            action -- 'insert', 'update' or 'delete'
+            rows   -- iterable of (card id, section id) tuples identifying
+                the changed rows, using None for the id that does not
+                apply
+        """
+        now = datetime.now()
+        changes = [
+            {
+                'kind': kind,
+                'action': action,
+                'card': card,
+                'section': section,
+                'changed': now
+            } for card, section in rows]
+
+        if not changes:
+            return
+
+        # Sequence numbers are allocated on insertion but become visible on
+        # commit, so transactions recording changes are serialized in order
+        # to commit them in the order of their sequence numbers, which is
+        # what readers of the change log rely on
+        lock_setting('change_lock')
+
+        size = max(1, _CHUNK_SIZE // len(Change._meta.fields))
+
+        for chunk in chunks(changes, size):
+            Change.insert_many(chunk).execute()
+
+    def _lookup(self, field, value):
+        """ Obtain a card or section by a unique field, through the lookup
+            cache if enabled.
+
+            Raises DoesNotExist if there is no such row.
+        """
+        model = field.model_class
+
+        # Rows read within a batch may not be committed yet, and those
+        # cached may have been changed by the batch
+        if self.lookup_cache is None or self._batch_ids() is not None:
+            return model.get(field == value)
+
+        key = (model.__name__, field.name, value)
+        row = self.lookup_cache.get(key)
+
+        if row is None:
+            version = self._lookup_version
+            row = model.get(field == value)
+
+            # Rows are not cached if the archive changed while querying
+            if version == self._lookup_version:
+                self.lookup_cache.set(key, row)
+
+        return row
+
+    def _match_terms(self, search_terms, likelihood, id_range=None):
+        """ Find the indexed terms that are similar to the query terms.
+
+            Each query term is only compared against the terms of the
+            vocabulary that share enough n-grams with it to possibly reach
+            the likelihood.
+
+            id_range -- (first, last) tuple of term ids to limit the
+                comparison to. When not given and the archive uses several
+                workers, the vocabulary is split among them
+
+            Returns a dict mapping each query term to a dict with the ids of
+            the indexed terms it matched and their scores.
+        """
+        if id_range is None and self.workers > 1:
+            return self._parallel_match_terms(search_terms, likelihood)
+
+        matches = dict((s_term, {}) for s_term in search_terms)
+
+        for s_term in search_terms:
+            candidates = list(
+                self._similar_terms(s_term, likelihood, id_range))
+            terms = [term for _, term in candidates]
+
+            scores = self.scorer.score(s_term, terms, likelihood)
+            count('comparisons', len(terms))
+
+            for (tid, _), score in zip(candidates, scores):
+                if score >= likelihood:
+                    matches[s_term][tid] = score
+
+        return matches
+
+    def _native_ranked(self, search_terms, section, likelihood, relevance,
+        limit):
+        """ Rank the relevant cards through the full-text search of the
+            database.
+
+            Scoring of a card stops as soon as it cannot beat the worst of
+            the best cards found so far.
+
+            Returns a heap of (score, -card id, CardObj) tuples.
+        """
+        ids = self.fulltext.match(search_terms, section.id if section else 0)
+
+        total = len(search_terms)
+        heap = []
+
+        for chunk in chunks(sorted(set(ids)), _CHUNK_SIZE):
+            cards = (Card
+                .select(*_LISTING)
+                .where(Card.id << chunk)
+                .order_by(Card.id))
+
+            for card in cards:
+                count('candidates')
+                terms = self._card_terms(card)
+                matched = 0
+                score = 0
+                remaining = total
+
+                for s_term in search_terms:
+                    remaining -= 1
+                    best = max(self.scorer.score(s_term, terms, likelihood))
+                    count('comparisons', len(terms))
+
+                    if best >= likelihood:
+                        matched += 1
+                        score += best
+
+                    bound = (score + remaining * 100) / total
+
+                    if len(heap) == limit and (bound, -card.id) <= heap[0][:2]:
+                        break
+
+                else:
+                    if _is_relevant(matched, total, relevance):
+                        item = (score / total, -card.id, CardObj(card))
+                        _push_bounded(heap, limit, item)
+
+        return heap
+
+    def _native_search(self, search_terms, section, likelihood, relevance):
+        """ Search for relevant cards through the full-text search of the
+            database.
+
+            Only the cards the database matched are fetched, and the query
+            terms are then compared against their terms in order to check
+            their relevance.
+
+            Returns a generator.
+        """
+        ids = self.fulltext.match(search_terms, section.id if section else 0)
+
+        for chunk in chunks(sorted(set(ids)), _CHUNK_SIZE):
+            # Fetched before yielding, as the rest of the generator may be
+            # consumed from a different thread
+            cards = list(Card
+                .select(*_LISTING)
+                .where(Card.id << chunk)
+                .order_by(Card.id))
+
+            for card in cards:
+                count('candidates')
+                terms = self._card_terms(card)
+                common = []
+
+                for s_term in search_terms:
+                    scores = self.scorer.score(s_term, terms, likelihood)
+                    count('comparisons', len(terms))
+
+                    if any(score >= likelihood for score in scores):
+                        common.append(s_term)
+
+                if not _is_relevant(len(common), len(search_terms), relevance):
+                    continue
+
+                yield CardObj(card)
+
+    def _new_terms(self, terms):
+        """ Add terms to the vocabulary along with their n-grams.
+
+            Returns a dict mapping each term to its id.
+        """
+        rows = [
+            {'term': term, 'length': len(term), 'grams': len(grams(term))}
+            for term in terms]
+
+        for chunk in chunks(rows, _CHUNK_SIZE // 3):
+            Term.insert_many(chunk).execute()
+
+        ids = self._resolve(Term.term, terms)
+
+        rows = [
+            {'gram': gram, 'term': ids[term]}
+            for term in terms for gram in grams(term)]
+
+        for chunk in chunks(rows, _CHUNK_SIZE // 2):
+            TermGram.insert_many(chunk).execute()
+
+        return ids
+
+    def _parallel_match_terms(self, search_terms, likelihood):
+        """ Find the indexed terms that are similar to the query terms using
+            the worker processes of the archive.
+
+            The vocabulary is split in ranges of term ids, and each worker
+            compares the query terms against one of them through its own
+            connection to the database.
+        """
+        matches = dict((s_term, {}) for s_term in search_terms)
+
+        first, last = (Term
+            .select(fn.MIN(Term.id), fn.MAX(Term.id))
+            .scalar(as_tuple=True))
+
+        if first is None:
+            return matches
+
+        step = (last - first) // self.workers + 1
+        pool = self._get_pool()
+
+        futures = [
+            pool.submit(
+                _match_terms_worker, self._config, search_terms, likelihood,
+                (start, min(start + step - 1, last)))
+            for start in range(first, last + 1, step)]
+
+        # Ranges do not overlap, so the order of the results is irrelevant
+        for future in futures:
+            for s_term, scores in future.result().items():
+                matches[s_term].update(scores)
+
+        return matches
+
+    def _post_terms(self, rows, term_ids):
+        """ Record the terms used by the cards in the index.
+
+            rows     -- iterable of (card id, term) tuples
+            term_ids -- dict mapping each term to its id
+        """
+        CardTerm.insert_many([
+            {'term': term_ids[term], 'card': cid}
+            for cid, term in rows]).execute()
+
+    def _prune_terms(self, term_ids):
+        """ Remove from the vocabulary the terms that no card uses anymore,
+            so that searches do not keep comparing them.
+
+            term_ids -- ids of the terms some card stopped using
+
+            A concurrent writer may start using a term again before it is
+            removed, in which case removing it fails and the term is kept.
+        """
+        for chunk in chunks(sorted(term_ids), _CHUNK_SIZE):
+            used = (CardTerm
+                .select(CardTerm.card)
+                .where(CardTerm.term == Term.id))
+            unused = list(Term
+                .select(Term.id, Term.term)
+                .where(Term.id << chunk, ~fn.EXISTS(used))
+                .tuples())
+
+            if not unused or self._remove_terms(unused):
+                continue
+
+            # Remove them one by one, keeping those used again
+            for row in unused:
+                self._remove_terms([row])
+
+    def _remember(self, field, rows):
+        """ Remember the ids of new cards or sections until the end of the
+            current batch, if any.
+
+            rows -- iterable of (value, id) tuples, the value being that
+                of the given unique field
+        """
+        ids = self._batch_ids()
+
+        if ids is None:
+            return
+
+        name = field.model_class.__name__
+
+        for value, oid in rows:
+            ids[(name, field.name, value)] = oid
+
+    def _remove_terms(self, rows):
+        """ Remove terms from the vocabulary along with their n-grams.
+
+            rows -- list of (id, term) tuples
+
+            Returns False if any of them is used by a card, in which case
+            none of them is removed.
+        """
+        ids = [tid for tid, _ in rows]
+
+        try:
+            with self.db.atomic():
+                TermGram.delete().where(TermGram.term << ids).execute()
+                Term.delete().where(Term.id << ids).execute()
+
+        except IntegrityError:
+            return False
+
+        self._forget_terms(term for _, term in rows)
+
+        return True
+
+    def _resolve(self, field, values):
+        """ Obtain the ids of the rows with the given values in a unique
+            field, using a single query per chunk of values.
+
+            Ids remembered by the current batch are not queried again.
+
+            Returns a dict mapping each value found to its id.
+        """
+        model = field.model_class
+        known = self._batch_ids()
+        values = set(values)
+        ids = {}
+
+        if known is not None:
+            for value in values:
+                key = (model.__name__, field.name, value)
+
+                if key in known:
+                    ids[value] = known[key]
+
+            values.difference_update(ids)
+
+        for chunk in chunks(values, _CHUNK_SIZE):
+            query = model.select(field, model.id).where(field << chunk)
+            found = list(query.tuples())
+
+            ids.update(found)
+            self._remember(field, found)
+
+        return ids
+
+    def _search(self, query, sname, sid, likelihood, relevance):
+        """ Search for relevant cards in the archive, see search().
+
+            Returns a generator.
+        """
+        search_terms = self.tokenizer.tokenize(query)
+        if not search_terms:
+            return
+
+        # Get the section to limit the search to
+        section = None
+
+        if sid or sname:
+            section = self.get_section(sname, sid)
+
+            if not section:
+                return
+
+        key = ('search', section.id if section else 0,
+            frozenset(search_terms), likelihood, relevance)
+        cache = self._search_cache()
+
+        if cache is not None:
+            ids = cache.get(key)
+
+            if ids is not None:
+                for card in self._cards_by_id(ids):
+                    count('matches')
+                    yield card
+
+                return
+
+        version = self._search_version
+
+        if self.fulltext:
+            cards = self._native_search(
+                search_terms, section, likelihood, relevance)
+
+        else:
+            cards = self._index_search(
+                search_terms, section, likelihood, relevance)
+
+        ids = []
+
+        for card in cards:
+            ids.append(card.id)
+            count('matches')
+            yield card
+
+        # Results are not cached if the archive changed while searching
+        if cache is not None and version == self._search_version:
+            cache.set(key, ids)
+
+    def _sign_cards(self, terms):
+        """ Update the MinHash signatures of several cards, along with
+            their LSH buckets.
+
+            terms -- dict mapping the id of each card to its set of terms.
+                The id itself is left out, as it is unique to every card
+        """
+        ids = sorted(terms)
+
+        for chunk in chunks(ids, _CHUNK_SIZE):
+            CardBucket.delete().where(CardBucket.card << chunk).execute()
+            CardSignature.delete().where(CardSignature.card << chunk).execute()
+
+        signatures = []
+        buckets = []
+
+        for cid in ids:
+            signature = minhash.signature(terms[cid] - set([str(cid)]))
+
+            if signature is None:
+                continue
+
+            signatures.append(
+                {'card': cid, 'signature': minhash.pack(signature)})
+            buckets.extend(
+                {'bucket': bucket, 'card': cid}
+                for bucket in minhash.buckets(signature))
+
+        for chunk in chunks(signatures, _CHUNK_SIZE // 2):
+            CardSignature.insert_many(chunk).execute()
+
+        for chunk in chunks(buckets, _CHUNK_SIZE // 2):
+            CardBucket.insert_many(chunk).execute()
+
+    def _signatures(self, ids):
+        """ Obtain the MinHash signatures of several cards.
+
+            Returns a dict mapping the id of each card that has a signature
+            to its signature.
+        """
+        signatures = {}
+
+        for chunk in chunks(ids, _CHUNK_SIZE):
+            query = (CardSignature
+                .select(CardSignature.card, CardSignature.signature)
+                .where(CardSignature.card << chunk)
+                .tuples())
+
+            signatures.update(
+                (cid, minhash.unpack(data)) for cid, data in query)
+
+        return signatures
+
+    def _search_cache(self):
+        """ Obtain the cache of search results, unless disabled or within
+            a batch, whose results may not be committed yet.
+        """
+        if self._batch_ids() is not None:
+            return None
+
+        return self.search_cache
+
+    def _similar_terms(self, s_term, likelihood, id_range=None):
+        """ Obtain the candidate terms of the vocabulary for a query term.
+
+            `partial_ratio` aligns the shorter term against the longer one,
+            so terms of the vocabulary at least as long as the query term
+            must contain a number of its n-grams, while shorter ones must
+            have enough of their own n-grams in common with it.
+
+            id_range -- (first, last) tuple of term ids to limit the
+                candidates to
+
+            Returns a set of (id, term) tuples.
+        """
+        length = len(s_term)
+        s_grams = grams(s_term)
+        required = len(s_grams) - lost_grams(length, likelihood)
+        ratio = lost_ratio(length, likelihood)
+
+        queries = []
+
+        if s_grams:
+            shared = fn.COUNT(TermGram.gram)
+
+            queries.append(Term
+                .select(Term.id, Term.term)
+                .join(TermGram)
+                .where(TermGram.gram << list(s_grams))
+                .group_by(Term.id, Term.term, Term.length, Term.grams)
+                .having(
+                    ((Term.length >= length) & (shared >= required)) |
+                    ((Term.length < length) &
+                        (shared * 1000 >=
+                            Term.grams * 1000 - Term.length * ratio))))
+
+        # Shorter terms that need not have any n-gram in common
+        queries.append(Term
+            .select(Term.id, Term.term)
+            .where(
+                (Term.length < length) &
+                (Term.grams * 1000 <= Term.length * ratio)))
+
+        # Longer terms cannot be discarded when the query term is too short
+        if required <= 0:
+            queries.append(Term
+                .select(Term.id, Term.term)
+                .where(Term.length >= length))
+
+        candidates = set()
+
+        for query in queries:
+            if id_range:
+                query = query.where(Term.id.between(*id_range))
+
+            candidates.update(query.tuples())
+
+        return candidates
+
+    def _split_content(self, content):
+        """ Decide where to store the content of a card.
+
+            Content larger than the compression threshold is compressed to
+            be stored apart, so that reading the card does not read it.
+
+            Returns a tuple with the content to store in the card, which is
+            empty if stored apart, and the (codec, data) tuple to store
+            apart or None.
+        """
+        if self.codec is None:
+            return content, None
+
+        if not isinstance(content, bytes):
+            size = len(content.encode('utf-8'))
+
+        else:
+            size = len(content)
+
+        if size < self.compression_threshold:
+            return content, None
+
+        return '', (self.codec.name, self.codec.compress_text(content))
+
+    def _store_content(self, cid, stored):
+        """ Replace the content stored apart from a card.
+
+            stored -- (codec, data) tuple to store, or None to only remove
+                the previous one
+        """
+        CardContent.delete().where(CardContent.card == cid).execute()
+
+        if stored is not None:
+            codec, data = stored
+            CardContent.insert(card=cid, codec=codec, data=data).execute()
+
+    def _tag_cards(self, cards):
+        """ Update the tags of several cards at once. """
+        for chunk in chunks([card.id for card in cards], _CHUNK_SIZE):
+            CardTag.delete().where(CardTag.card << chunk).execute()
+
+        tags = dict((card.id, card_tags(card)) for card in cards)
+
+        names = set()
+        for words in tags.values():
+            names.update(words)
+
+        tag_ids = self._tag_ids(names)
+
+        rows = [
+            {'tag': tag_ids[tag], 'card': cid}
+            for cid in sorted(tags) for tag in tags[cid]]
+
+        for chunk in chunks(rows, _CHUNK_SIZE // 2):
+            CardTag.insert_many(chunk).execute()
+
+    def _tag_filter(self, field, all_of, any_of, none_of):
+        """ Build the conditions for a card to have the given tags.
+
+            field -- field containing the id of the card
+
+            Tags are resolved beforehand, so that the conditions only
+            involve the card-tag relation.
+
+            Returns a list of expressions, or None if no card can satisfy
+            them.
+        """
+        all_of, any_of, none_of = [
+            set(tag.lower() for tag in tags)
+            for tags in (all_of, any_of, none_of)]
+
+        ids = self._resolve(Tag.name, all_of | any_of | none_of)
+        conditions = []
+
+        if all_of:
+            if not all_of.issubset(ids):
+                return None
+
+            tags = [ids[tag] for tag in all_of]
+            cards = (CardTag
+                .select(CardTag.card)
+                .where(CardTag.tag << tags)
+                .group_by(CardTag.card)
+                .having(fn.COUNT(CardTag.tag) == len(tags)))
 
-            These parameters vary from one DBMS to another.
-        """
-        # Need to initialize the database for the models
-        self.db = self._init_db(**kwargs)
-        _db_proxy.initialize(self.db)
+            conditions.append(field << cards)
 
-        try:
-            # Create tables
-            self.db.create_tables([Card, Section, Relation], True)
+        if any_of:
+            tags = [ids[tag] for tag in any_of if tag in ids]
 
-        except ImproperlyConfigured as e:
-            raise ArchiveConfigException(str(e))
+            if not tags:
+                return None
 
-    def _init_db(self, **kwargs):
-        """ Parse the arguments and initialize the proper database.
+            cards = CardTag.select(CardTag.card).where(CardTag.tag << tags)
+            conditions.append(field << cards)
 
-            The parameters used for each database are given directly to
-            their specific connectors:
+        tags = [ids[tag] for tag in none_of if tag in ids]
 
-            - MySQL: PyMySQL
-            - SQLite: sqlite3
-            - PostgreSQL: psycopg2
+        if tags:
+            cards = CardTag.select(CardTag.card).where(CardTag.tag << tags)
+            conditions.append(field.not_in(cards))
 
-            Check their documentation for more information on the available
-            parameters.
+        return conditions
 
-            Here we only care about the database type, which could be either
-            'mysql', 'sqlite' or 'postgres'
+    def _tag_ids(self, tags):
+        """ Obtain the ids of the given tags, adding those that are not
+            present yet.
 
-            Returns an already initialized databased.
+            Returns a dict mapping each tag to its id.
         """
-        db_name = kwargs.pop('db_name')
-        db_type = kwargs.pop('db_type')
+        ids = self._resolve(Tag.name, tags)
+        missing = [tag for tag in tags if tag not in ids]
+
+        if not missing:
+            return ids
 
         try:
-            if db_type == 'mysql':
-                return MySQLDatabase(db_name, **kwargs)
+            with self.db.atomic():
+                for chunk in chunks(missing, _CHUNK_SIZE):
+                    Tag.insert_many([{'name': tag} for tag in chunk]).execute()
 
-            elif db_type == 'postgres':
-                return PostgresqlDatabase(db_name, **kwargs)
+        except IntegrityError:
+            # Some were added concurrently, add them one by one
+            for tag in missing:
+                try:
+                    with self.db.atomic():
+                        Tag.create(name=tag)
 
-            elif db_type == 'sqlite':
-                return SqliteDatabase(db_name)
+                except IntegrityError:
+                    pass
 
-        except OperationalError as e:
-            raise ArchiveConnectionException(str(e))
+        ids.update(self._resolve(Tag.name, missing))
 
-        raise ArchiveConnectionException('Invalid database type')
+        return ids
+
+    def _term_ids(self, terms):
+        """ Obtain the ids of the given terms, adding to the vocabulary
+            those that are not present yet.
 
+            Returns a dict mapping each term to its id.
+        """
+        ids = self._resolve(Term.term, terms)
+        missing = [term for term in terms if term not in ids]
+
+        if not missing:
+            return ids
+
+        try:
+            with self.db.atomic():
+                ids.update(self._new_terms(missing))
+
+        except IntegrityError:
+            # Some were added concurrently, add them one by one
+            for term in missing:
+                try:
+                    with self.db.atomic():
+                        ids.update(self._new_terms([term]))
+
+                except IntegrityError:
+                    ids[term] = Term.get(Term.term == term).id
+
+        return ids
+
+    @_writes
+    @_bound
     def add_card_to_section(self, cid=0, ctitle="", sid=0, sname=""):
         """ Create a card-section relation.
 
@@ -97,31 +1550,477 @@ class Archive(object):
             'section': None
         }
 
-        if cid:
-            attrs['card'] = cid
-        else:
-            attrs['card'] = self.get_card(title=ctitle).id
+        try:
+            if cid:
+                attrs['card'] = cid
+            else:
+                attrs['card'] = self._id_of(Card.title, ctitle)
 
-        if sid:
-            attrs['section'] = sid
-        else:
-            attrs['section'] = self.get_section(name=sname).id
+            if sid:
+                attrs['section'] = sid
+            else:
+                attrs['section'] = self._id_of(Section.name, sname)
 
-        try:
-            Relation.create(**attrs)
+            with self.db.atomic():
+                Relation.create(**attrs)
+                self._log_changes(
+                    'relation', 'insert', [(attrs['card'], attrs['section'])])
 
         except DoesNotExist:
             return False
 
+        self._invalidate_search([attrs['section']])
+
         return True
 
-    def cards(self):
-        """ Return a generator for all the cards in the archive. """
-        cards = Card.select()
+    @contextmanager
+    def batch(self):
+        """ Group several changes to the archive in a single transaction.
 
-        for card in cards:
-            yield CardObj(card)
+            The changes made from the current thread within the context
+            are committed together when it exits, or rolled back if an
+            exception (such as ArchiveIntegrityException) is raised. Batches
+            may be nested, in which case only the outermost one commits.
+
+            The ids of the cards and sections identified by their title or
+            name are remembered until the batch ends, so they are only
+            queried once. The caches of the archive are not used within
+            the batch, and the entries affected by its changes are only
+            removed once it is committed.
+
+            Returns a context manager, which yields the archive.
+        """
+        outer = self._batch_ids() is None
+
+        if outer:
+            self._batch.ids = {}
+            self._batch.sections = set()
+            self._batch.forgotten = set()
+
+        try:
+            with _db_proxy.bind(self.db):
+                with self.db.atomic():
+                    yield self
+
+        except Exception:
+            # Ids may refer to changes rolled back
+            self._batch.ids.clear()
+            self._clear_caches()
+            raise
+
+        finally:
+            if outer:
+                sections = self._batch.sections
+                forgotten = self._batch.forgotten
+
+                self._batch.ids = None
+                self._batch.sections = None
+                self._batch.forgotten = None
+
+        if outer:
+            # Rows cached by other threads during the batch are stale now
+            self._invalidate_search(sections)
+            self._discard_lookups(forgotten)
+
+    @_writes
+    @_bound
+    def bulk_add_to_sections(self, relations, chunk_size=1000):
+        """ Create several card-section relations.
+
+            relations  -- iterable of (card, section) tuples, where the card
+                    is identified by its id or title and the section by
+                    its id or name
+            chunk_size -- number of relations inserted in each transaction
+
+            Cards and sections of each chunk are resolved with a single
+            query, and relations that cannot be created are reported
+            without aborting the rest.
+
+            Returns a tuple with the list of (card id, section id) tuples of
+            the new relations and the list of (position, error) tuples of
+            the failed ones.
+        """
+        added = []
+        failed = []
+
+        for batch in chunks(enumerate(relations), chunk_size):
+            with self.db.atomic():
+                cards = [card for _, (card, _) in batch]
+                sections = [section for _, (_, section) in batch]
+
+                card_ids = self._resolve(
+                    Card.id,
+                    [c for c in cards if isinstance(c, numbers.Integral)])
+                card_ids.update(self._resolve(
+                    Card.title,
+                    [c for c in cards if not isinstance(c, numbers.Integral)]))
+
+                section_ids = self._resolve(
+                    Section.id,
+                    [s for s in sections if isinstance(s, numbers.Integral)])
+                section_ids.update(self._resolve(
+                    Section.name,
+                    [s for s in sections
+                        if not isinstance(s, numbers.Integral)]))
+
+                # Relations that already exist
+                existing = set()
+
+                for chunk in chunks(set(card_ids.values()), _CHUNK_SIZE):
+                    query = (Relation
+                        .select(Relation.card, Relation.section)
+                        .where(Relation.card << chunk))
+
+                    existing.update(query.tuples())
+
+                rows = []
+
+                for position, (card, section) in batch:
+                    if card not in card_ids:
+                        failed.append((position, 'card does not exist'))
+                        continue
+
+                    if section not in section_ids:
+                        failed.append((position, 'section does not exist'))
+                        continue
+
+                    pair = (card_ids[card], section_ids[section])
+
+                    if pair in existing:
+                        failed.append((position, 'relation already exists'))
+                        continue
+
+                    existing.add(pair)
+                    rows.append(
+                        (position, {'card': pair[0], 'section': pair[1]}))
+
+                errors = self._bulk_insert(Relation, rows)
+                failed.extend(errors)
+
+                errors = set(position for position, _ in errors)
+                new = [
+                    (attrs['card'], attrs['section'])
+                    for position, attrs in rows if position not in errors]
+
+                self._log_changes('relation', 'insert', new)
+                added.extend(new)
+
+        self._invalidate_search(set(sid for _, sid in added))
+
+        return added, sorted(failed)
+
+    @_writes
+    @_bound
+    def bulk_new_cards(self, cards, author="UNKNOWN", chunk_size=1000):
+        """ Add several cards to the archive.
+
+            cards      -- iterable of dicts with the 'title', 'desc',
+                    'content' and 'tags' of each card, and optionally
+                    its 'author' and 'modified' datetime
+            author     -- author of the cards that do not specify one
+            chunk_size -- number of cards inserted in each transaction
+
+            Cards are inserted and indexed using multi-row statements, and
+            cards that cannot be created are reported without aborting the
+            rest.
+
+            Returns a tuple with the list of ids of the new cards and the
+            list of (position, error) tuples of the failed ones.
+        """
+        created = []
+        failed = []
+
+        for batch in chunks(enumerate(cards), chunk_size):
+            with self.db.atomic():
+                now = datetime.now()
+                rows = []
+
+                # Contents stored apart, by position
+                stored = {}
+
+                for position, attrs in batch:
+                    try:
+                        content, apart = self._split_content(attrs['content'])
+
+                        rows.append((position, {
+                            'title': attrs['title'],
+                            'desc': attrs['desc'],
+                            'content': content,
+                            'tags': attrs['tags'],
+                            'modified': attrs.get('modified', now),
+                            'modified_by': attrs.get('author', author)
+                        }))
+
+                    except KeyError as e:
+                        failed.append((position, 'missing field %s' % e))
+                        continue
+
+                    if apart is not None:
+                        stored[position] = apart
+
+                # Titles already present are discarded beforehand
+                existing = set(
+                    self._resolve(Card.title, [r['title'] for _, r in rows]))
+
+                valid = []
+
+                for position, row in rows:
+                    if row['title'] in existing:
+                        failed.append((position, 'title already exists'))
+                        continue
+
+                    existing.add(row['title'])
+                    valid.append((position, row))
+
+                errors = self._bulk_insert(Card, valid)
+                failed.extend(errors)
+
+                errors = set(position for position, _ in errors)
+
+                # Titles are unique among the inserted rows, so they
+                # identify the position each new card was given at
+                positions = dict(
+                    (row['title'], position) for position, row in valid
+                    if position not in errors)
+
+                new = []
+
+                for chunk in chunks(list(positions), _CHUNK_SIZE):
+                    new.extend(
+                        Card.select(*_LISTING).where(Card.title << chunk))
+
+                # Large contents are inserted one at a time, so that
+                # statements do not grow too large
+                for card in new:
+                    apart = stored.get(positions[card.title])
+
+                    if apart is not None:
+                        self._store_content(card.id, apart)
+
+                self._index_cards(new)
+
+                ids = sorted(card.id for card in new)
+                self._remember(Card.title, [(c.title, c.id) for c in new])
+                self._log_changes(
+                    'card', 'insert', [(cid, None) for cid in ids])
+                created.extend(ids)
+
+        self._invalidate_search([0])
+
+        return created, sorted(failed)
+
+    @_writes
+    @_bound
+    def bulk_new_sections(self, names, chunk_size=1000):
+        """ Create several sections in the archive.
+
+            names      -- iterable of section names
+            chunk_size -- number of sections inserted in each transaction
+
+            Returns a tuple with the list of ids of the new sections and the
+            list of (position, error) tuples of the failed ones.
+        """
+        created = []
+        failed = []
+
+        for batch in chunks(enumerate(names), chunk_size):
+            with self.db.atomic():
+                existing = set(
+                    self._resolve(Section.name, [name for _, name in batch]))
+
+                valid = []
+
+                for position, name in batch:
+                    if name in existing:
+                        failed.append((position, 'name already exists'))
+                        continue
+
+                    existing.add(name)
+                    valid.append((position, {'name': name}))
+
+                errors = self._bulk_insert(Section, valid)
+                failed.extend(errors)
+
+                errors = set(position for position, _ in errors)
+                ids = self._resolve(
+                    Section.name,
+                    [row['name'] for position, row in valid
+                        if position not in errors])
+
+                ids = sorted(ids.values())
+                self._log_changes(
+                    'section', 'insert', [(None, sid) for sid in ids])
+                created.extend(ids)
+
+        return created, sorted(failed)
+
+    @_bound
+    def cards(self, prefetch_sections=False, after_id=0, limit=None,
+        chunk_size=1000):
+        """ Return a generator for the cards in the archive, ordered by id.
+
+            prefetch_sections -- load the sections of the cards beforehand,
+                using a single query for each chunk of cards
+            after_id   -- only obtain the cards whose id is greater than
+                this one
+            limit      -- maximum number of cards to obtain. All of them
+                are obtained if not provided
+            chunk_size -- number of cards fetched from the database at a
+                time
+
+            Cards are fetched in pages ordered by id, so memory usage does
+            not depend on the size of the archive. In order to paginate,
+            pass the id of the last card obtained as `after_id`.
+        """
+        pages = self._keyset_pages(
+            Card.select(*_LISTING), Card.id, chunk_size, after_id, limit)
+
+        for page in pages:
+            cards = [CardObj(card) for card in page]
+
+            if prefetch_sections:
+                self._attach_sections(cards)
+
+            for card in cards:
+                yield card
+
+    @_bound
+    def cards_by_tags(self, all_of=(), any_of=(), none_of=(), after_id=0,
+        limit=None, chunk_size=1000):
+        """ Return a generator for the cards with the given tags, ordered
+            by id.
+
+            all_of     -- tags that the cards must have
+            any_of     -- tags of which the cards must have at least one
+            none_of    -- tags that the cards must not have
+            after_id   -- only obtain the cards whose id is greater than
+                this one
+            limit      -- maximum number of cards to obtain. All of them
+                are obtained if not provided
+            chunk_size -- number of cards fetched from the database at a
+                time
+
+            Tags are compared exactly, ignoring case, and are filtered by
+            the database through the tag index of the archive.
+        """
+        conditions = self._tag_filter(Card.id, all_of, any_of, none_of)
+
+        if conditions is None:
+            return
+
+        query = Card.select(*_LISTING)
+
+        if conditions:
+            query = query.where(*conditions)
+
+        pages = self._keyset_pages(query, Card.id, chunk_size, after_id, limit)
+
+        for page in pages:
+            for card in page:
+                yield CardObj(card)
+
+    @_bound
+    def cards_with_sections(self, ids):
+        """ Obtain several cards along with the sections they appear in.
+
+            ids -- ids of the cards
+
+            Only two queries are performed for every chunk of cards, rather
+            than one more query for each card whose sections are listed.
+
+            Returns a list of CardObj, in the same order as the ids.
+        """
+        return self._attach_sections(list(self._cards_by_id(ids)))
+
+    @_bound
+    def change_seq(self):
+        """ Obtain the sequence number of the last change recorded in the
+            change log.
+
+            Returns 0 if no change has been recorded yet.
+        """
+        return Change.select(fn.MAX(Change.id)).scalar() or 0
+
+    @_bound
+    def changes(self, since=0, limit=None, chunk_size=1000):
+        """ Return a generator for the changes made to the archive after a
+            given one, in the order they were recorded.
+
+            since      -- sequence number of the last change already
+                processed. All the recorded changes are obtained if not
+                provided
+            limit      -- maximum number of changes to obtain. All of them
+                are obtained if not provided
+            chunk_size -- number of changes fetched from the database at
+                a time
+
+            Every insertion, modification and deletion of cards, sections
+            and card-section relations is recorded, the relations of a
+            deleted card or section being deleted before it. In order to
+            keep a copy of the archive in sync, pass the `seq` of the last
+            change processed as `since`.
+        """
+        pages = self._keyset_pages(
+            Change.select(), Change.id, chunk_size, since, limit)
+
+        for page in pages:
+            for change in page:
+                yield ChangeObj(change)
+
+    def close(self):
+        """ Close the connection to the database and stop the worker
+            processes of the archive, if any.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+        # Only the connection of the current thread can be closed, which
+        # is not open if the thread did not use the archive
+        if not self.db.is_closed():
+            self.db.close()
+
+        if isinstance(self.db, PooledDatabase):
+            self.db.close_all()
+
+    @_writes
+    @_bound
+    def compact(self, chunk_size=100):
+        """ Compress and store apart the content of the cards that exceeds
+            the compression threshold but was stored in the card, such as
+            the content written before enabling compression.
+
+            chunk_size -- number of cards processed in each transaction
+
+            Returns the number of cards whose content was stored apart.
+        """
+        if self.codec is None:
+            return 0
+
+        # Text cannot take more than 4 bytes per character in UTF-8
+        query = (Card
+            .select(Card.id, Card.content)
+            .where(fn.LENGTH(Card.content) >= self.compression_threshold // 4))
+
+        compacted = 0
+
+        for page in self._keyset_pages(query, Card.id, chunk_size):
+            with self.db.atomic():
+                for card in page:
+                    content, stored = self._split_content(card.content)
 
+                    if stored is None:
+                        continue
+
+                    Card.update(content=content).where(
+                        Card.id == card.id).execute()
+                    self._store_content(card.id, stored)
+                    compacted += 1
+
+        return compacted
+
+    @_writes
+    @_bound
     def delete_card(self, cid=0, title=""):
         """ Delete a card from the archive.
 
@@ -142,13 +2041,36 @@ class Archive(object):
         except DoesNotExist:
             return False
 
-        deleted = card.delete_instance(recursive=True, delete_nullable=True)
+        sections = self._card_sections(card.id)
+
+        with self.db.atomic():
+            terms = (CardTerm
+                .select(CardTerm.term)
+                .where(CardTerm.card == card.id)
+                .tuples())
+
+            terms = [tid for tid, in terms]
+            deleted = card.delete_instance(
+                recursive=True, delete_nullable=True)
+
+            self._prune_terms(terms)
+
+            self._log_changes(
+                'relation', 'delete', [(card.id, sid) for sid in sections])
+            self._log_changes('card', 'delete', [(card.id, None)])
+
+        # Invalidated once committed, so that searches running meanwhile
+        # cannot cache the card again
+        self._invalidate_search([0] + sections)
+        self._forget(Card.title, card.id, card.title)
 
         if deleted > 0:
             return True
 
         return False
 
+    @_writes
+    @_bound
     def delete_section(self, name="", sid=0):
         """ Delete a section from the archive.
 
@@ -169,13 +2091,99 @@ class Archive(object):
         except DoesNotExist:
             return False
 
-        deleted = section.delete_instance(recursive=True, delete_nullable=True)
+        with self.db.atomic():
+            cards = (Relation
+                .select(Relation.card)
+                .where(Relation.section == section.id)
+                .tuples())
+
+            cards = [cid for cid, in cards]
+            deleted = section.delete_instance(
+                recursive=True, delete_nullable=True)
+
+            self._log_changes(
+                'relation', 'delete', [(cid, section.id) for cid in cards])
+            self._log_changes('section', 'delete', [(None, section.id)])
+
+        self._invalidate_search([section.id])
+        self._forget(Section.name, section.id, section.name)
 
         if deleted > 0:
             return True
 
         return False
 
+    @_bound
+    def export(self, path):
+        """ Export the sections, cards and relations of the archive to a
+            dump file.
+
+            path -- path of the dump. Ending it in '.gz' compresses it
+                using gzip and ending it in '.zst' using zstandard
+
+            Rows are read in pages and written as they are read, so memory
+            use does not depend on the size of the archive.
+
+            Returns the number of records written.
+        """
+        with open_dump(path, 'w') as f:
+            return write_records(f, self._export_records())
+
+    @_bound
+    def find_duplicates(self, threshold=0.8):
+        """ Find the pairs of cards that are near duplicates of each other.
+
+            threshold -- minimum estimated similarity (from 0 to 1) of the
+                terms of two cards for them to be considered duplicates
+
+            Only the cards sharing an LSH bucket are compared, which the
+            database finds through an aggregate query, so pairs below a
+            similarity of about 0.5 are rarely found regardless of the
+            threshold.
+
+            Returns a list of (card id, card id, similarity) tuples, most
+            similar first.
+        """
+        shared = (CardBucket
+            .select(CardBucket.bucket)
+            .group_by(CardBucket.bucket)
+            .having(fn.COUNT(CardBucket.card) > 1)
+            .tuples())
+
+        shared = [bucket for bucket, in shared]
+        signatures = {}
+        compared = set()
+        pairs = []
+
+        for chunk in chunks(shared, _CHUNK_SIZE):
+            rows = list(CardBucket
+                .select(CardBucket.bucket, CardBucket.card)
+                .where(CardBucket.bucket << chunk)
+                .order_by(CardBucket.bucket, CardBucket.card)
+                .tuples())
+
+            signatures.update(self._signatures(
+                set(cid for _, cid in rows if cid not in signatures)))
+
+            for _, group in itertools.groupby(rows, key=lambda r: r[0]):
+                ids = [cid for _, cid in group]
+
+                for pair in itertools.combinations(ids, 2):
+                    if pair in compared:
+                        continue
+
+                    compared.add(pair)
+                    score = minhash.similarity(
+                        signatures[pair[0]], signatures[pair[1]])
+
+                    if score >= threshold:
+                        pairs.append(pair + (score,))
+
+        pairs.sort(key=lambda p: (-p[2], p[0], p[1]))
+
+        return pairs
+
+    @_bound
     def get_card(self, cid=0, title=""):
         """ Obtain a specific card from the archive.
 
@@ -186,16 +2194,17 @@ class Archive(object):
         """
         try:
             if cid:
-                return CardObj(Card.get(Card.id == cid))
+                return CardObj(self._lookup(Card.id, cid))
 
             elif title:
-                return CardObj(Card.get(Card.title == title))
+                return CardObj(self._lookup(Card.title, title))
 
         except DoesNotExist:
             return None
 
         return None
 
+    @_bound
     def get_section(self, name="", sid=0):
         """ Obtain a specific section from the archive.
 
@@ -205,16 +2214,82 @@ class Archive(object):
         """
         try:
             if name:
-                return SectionObj(Section.get(Section.name == name))
+                return SectionObj(self._lookup(Section.name, name))
 
             elif sid:
-                return SectionObj(Section.get(Section.id == sid))
+                return SectionObj(self._lookup(Section.id, sid))
 
         except DoesNotExist:
             return None
 
         return None
 
+    @_writes
+    @_bound
+    def import_(self, path, chunk_size=1000):
+        """ Import the sections, cards and relations of a dump file created
+            by export().
+
+            path       -- path of the dump
+            chunk_size -- number of rows inserted in each transaction
+
+            Records are read as a stream and inserted in chunks using the
+            bulk functions of the archive, so that memory use does not
+            depend on the size of the dump.
+
+            Returns a tuple with a dict holding the number of sections,
+            cards and relations imported, and the list of (line number,
+            error) tuples of the records that could not be imported.
+        """
+        imported = {'section': 0, 'card': 0, 'relation': 0}
+        failed = []
+
+        with open_dump(path, 'r') as f:
+            groups = itertools.groupby(
+                read_records(f), key=lambda r: r[1].get('type'))
+
+            for rtype, group in groups:
+                first, record = next(group)
+                records = (r for _, r in itertools.chain(
+                    [(first, record)], group))
+
+                if rtype == 'section':
+                    created, errors = self.bulk_new_sections(
+                        (r['name'] for r in records), chunk_size)
+
+                elif rtype == 'card':
+                    created, errors = self.bulk_new_cards((
+                        {
+                            'title': r['title'],
+                            'desc': r['desc'],
+                            'content': r['content'],
+                            'tags': r['tags'],
+                            'author': r['modified_by'],
+                            'modified': parse_date(r['modified'])
+                        } for r in records), chunk_size=chunk_size)
+
+                elif rtype == 'relation':
+                    created, errors = self.bulk_add_to_sections(
+                        ((r['card'], r['section']) for r in records),
+                        chunk_size)
+
+                else:
+                    created = []
+                    errors = [
+                        (position, 'unknown record type')
+                        for position, _ in enumerate(records)]
+
+                if rtype in imported:
+                    imported[rtype] += len(created)
+
+                # Records of a group are in consecutive lines
+                failed.extend(
+                    (first + position, error) for position, error in errors)
+
+        return imported, failed
+
+    @_writes
+    @_bound
     def modify_card(self, card=None, cid=0, ctitle="",
         title="", desc="", content="", tags="", author="UNKNOWN"):
         """ Modifies an already existing card overwriting its information
@@ -256,22 +2331,41 @@ class Archive(object):
         except DoesNotExist:
             return None
 
+        previous = modcard.title
+
         modcard.title = title if title else modcard.title
         modcard.desc = desc if desc else modcard.desc
-        modcard.content = content if content else modcard.content
+        if content:
+            modcard.content, stored = self._split_content(content)
         modcard.tags = tags if tags else modcard.tags
         modcard.modified = datetime.now()
         modcard.modified_by = author
 
         try:
-            modcard.save()
+            with self.db.atomic():
+                modcard.save()
+
+                if content:
+                    self._store_content(modcard.id, stored)
+
+                self._index_card(modcard)
+                self._log_changes('card', 'update', [(modcard.id, None)])
 
         except IntegrityError as e:
-            self.db.rollback()
             raise ArchiveIntegrityException(str(e))
 
-        return CardObj(modcard)
+        self._invalidate_search([0] + self._card_sections(modcard.id))
+        self._forget(Card.title, modcard.id, previous)
+
+        modcard = CardObj(modcard)
+
+        if content:
+            modcard.content = content
+
+        return modcard
 
+    @_writes
+    @_bound
     def new_card(self, title, desc, content, tags, author="UNKNOWN"):
         """ Add a new card to the archive.
 
@@ -283,23 +2377,40 @@ class Archive(object):
 
             Returns the newly created card
         """
+        inline, stored = self._split_content(content)
+
         attrs = {
             'title': title,
             'desc': desc,
-            'content': content,
+            'content': inline,
             'tags': tags,
             'modified': datetime.now(),
             'modified_by': author
         }
 
         try:
+            with self.db.atomic():
+                card = Card.create(**attrs)
+
+                if stored is not None:
+                    self._store_content(card.id, stored)
 
-            return CardObj(Card.create(**attrs))
+                self._index_card(card)
+                self._log_changes('card', 'insert', [(card.id, None)])
+                self._remember(Card.title, [(card.title, card.id)])
 
         except IntegrityError as e:
-            self.db.rollback()
             raise ArchiveIntegrityException(str(e))
 
+        self._invalidate_search([0])
+
+        card = CardObj(card)
+        card.content = content
+
+        return card
+
+    @_writes
+    @_bound
     def new_section(self, name):
         """ Create a new section in the archive.
 
@@ -312,12 +2423,62 @@ class Archive(object):
         }
 
         try:
-            return SectionObj(Section.create(**attrs))
+            with self.db.atomic():
+                section = Section.create(**attrs)
+                self._log_changes('section', 'insert', [(None, section.id)])
+                self._remember(Section.name, [(section.name, section.id)])
 
         except IntegrityError as e:
-            self.db.rollback()
             raise ArchiveIntegrityException(str(e))
 
+        return SectionObj(section)
+
+    @_writes
+    @_bound
+    def prune_changes(self, before):
+        """ Remove old changes from the change log.
+
+            before -- sequence number of the first change to keep
+
+            The last change is always kept, so that sequence numbers are
+            never reused.
+
+            Returns the number of changes removed.
+        """
+        before = min(before, self.change_seq())
+
+        return Change.delete().where(Change.id < before).execute()
+
+    @_writes
+    @_bound
+    def reindex(self):
+        """ Rebuild the search term index, the tags and the signatures of
+            the archive from scratch.
+
+            The index is kept up to date by the archive itself, so this is
+            only needed when the database has been modified externally.
+        """
+        with self.db.atomic():
+            CardTerm.delete().execute()
+            TermGram.delete().execute()
+            Term.delete().execute()
+            CardTag.delete().execute()
+            Tag.delete().execute()
+            CardBucket.delete().execute()
+            CardSignature.delete().execute()
+            set_setting('tokenizer', self.tokenizer.name)
+
+        # Each page of cards is indexed in its own transaction
+        for page in self._keyset_pages(Card.select(*_LISTING), Card.id):
+            with self.db.atomic():
+                self._index_cards(page)
+
+        if self.search_cache is not None:
+            self._search_version += 1
+            self.search_cache.clear()
+
+    @_writes
+    @_bound
     def remove_card_from_section(self, cid=0, ctitle="", sid=0, sname=""):
         """ Remove a card-section relation.
 
@@ -328,17 +2489,17 @@ class Archive(object):
 
             Returns boolean for success or failure
         """
-        if cid:
-            card = cid
-        else:
-            card = self.get_card(title=ctitle).id
+        try:
+            if cid:
+                card = cid
+            else:
+                card = self._id_of(Card.title, ctitle)
 
-        if sid:
-            section = sid
-        else:
-            section = self.get_section(name=sname).id
+            if sid:
+                section = sid
+            else:
+                section = self._id_of(Section.name, sname)
 
-        try:
             rel = Relation.get(
                 Relation.card == card,
                 Relation.section == section)
@@ -346,13 +2507,20 @@ class Archive(object):
         except DoesNotExist:
             return False
 
-        deleted = rel.delete_instance()
+        with self.db.atomic():
+            deleted = rel.delete_instance()
+
+            if deleted > 0:
+                self._log_changes('relation', 'delete', [(card, section)])
 
         if deleted > 0:
+            self._invalidate_search([section])
             return True
 
         return False
 
+    @_writes
+    @_bound
     def rename_section(self, newname, oldname="", sid=0):
         """ Rename a section.
 
@@ -371,17 +2539,24 @@ class Archive(object):
         except DoesNotExist:
             raise ArchiveOperationException('section does not exist')
 
+        previous = section.name
         section.name = newname
         try:
-            section.save()
+            with self.db.atomic():
+                section.save()
+                self._log_changes('section', 'update', [(None, section.id)])
 
         except IntegrityError as e:
-            self.db.rollback()
             raise ArchiveIntegrityException(str(e))
 
+        self._invalidate_search([section.id])
+        self._forget(Section.name, section.id, previous)
+
         return SectionObj(section)
 
-    def search(self, query, sname="", sid=0, likelihood=80, relevance=50):
+    @_bound
+    def search(self, query, sname="", sid=0, likelihood=80, relevance=50,
+        prefetch_sections=False):
         """ Search for relevant cards in the archive.
 
             query      -- search terms, separated by blankspace
@@ -391,55 +2566,207 @@ class Archive(object):
                     similar.
             relevance  -- percentage of query terms that must be present in
                     a card for it to be considered relevant
+            prefetch_sections -- load the sections of the resulting cards
+                    beforehand, using a single query for each chunk of
+                    cards
 
             Returns a generator.
         """
-        search_terms = set([t.lower() for t in query.split()])
-        if not search_terms:
+        cards = self._search(query, sname, sid, likelihood, relevance)
+
+        if not prefetch_sections:
+            for card in cards:
+                yield card
+
             return
 
-        # Get the list of cards to iterate
+        for chunk in chunks(cards, _CHUNK_SIZE):
+            for card in self._attach_sections(chunk):
+                yield card
+
+    @_bound
+    def search_ranked(self, query, limit=20, sname="", sid=0, likelihood=80,
+        relevance=50):
+        """ Search for the most relevant cards in the archive.
+
+            query      -- search terms, separated by blankspace
+            limit      -- maximum number of cards to obtain
+            section    -- section to perform the search in. If not provided,
+                    will search the whole archive.
+            likelihood -- percentage for which to words should be considered
+                    similar.
+            relevance  -- percentage of query terms that must be present in
+                    a card for it to be considered relevant
+
+            The score of a card is the average, for every query term, of the
+            similarity of the most similar term of the card (0 if none
+            reaches the likelihood).
+
+            Returns a list of (CardObj, score) tuples, best first.
+        """
+        search_terms = self.tokenizer.tokenize(query)
+        if not search_terms or limit < 1:
+            return []
+
+        # Get the section to limit the search to
+        section = None
+
         if sid or sname:
             section = self.get_section(sname, sid)
 
             if not section:
-                return
+                return []
 
-            # Raw card search
-            cards = (Card
-                .select()
-                .join(Relation)
-                .join(Section)
-                .where(Section.id == section.id))
+        key = ('ranked', section.id if section else 0,
+            frozenset(search_terms), likelihood, relevance, limit)
+        cache = self._search_cache()
+
+        if cache is not None:
+            scored = cache.get(key)
+
+            if scored is not None:
+                scores = dict(scored)
+                cards = self._cards_by_id([cid for cid, _ in scored])
+
+                return [(card, scores[card.id]) for card in cards]
+
+        version = self._search_version
+
+        if self.fulltext:
+            heap = self._native_ranked(
+                search_terms, section, likelihood, relevance, limit)
+
+            ranked = [(card, score) for score, _, card in heap]
 
         else:
-            cards = Card.select()
+            heap = self._index_ranked(
+                search_terms, section, likelihood, relevance, limit)
 
-        # Compare each card
-        for card in cards:
-            s_card = "%s %s %s %s" % (
-                str(card.id), card.title, card.desc, card.tags)
+            scores = dict((-ncid, score) for score, ncid in heap)
+            cards = self._cards_by_id(list(scores))
 
-            card_terms = set([t.lower() for t in s_card.split()])
+            ranked = [(card, scores[card.id]) for card in cards]
 
-            common = set()
+        ranked.sort(key=lambda r: (-r[1], r[0].id))
+        count('matches', len(ranked))
 
-            for c_term in card_terms:
-                # Check each search term with those from card
-                for s_term in search_terms:
-                    if fuzz.partial_ratio(s_term, c_term) >= 80:
-                        common.add(s_term)
-                        break
+        # Results are not cached if the archive changed while searching
+        if cache is not None and version == self._search_version:
+            cache.set(key, [(card.id, score) for card, score in ranked])
 
-            # Check if the card is relevant
-            if int((len(common) / len(search_terms)) * 100) < 50:
-                continue
+        return ranked
 
-            yield CardObj(card)
+    @_bound
+    def sections(self, prefetch_cards=False, after_id=0, limit=None,
+        chunk_size=1000):
+        """ Return a generator for the sections in the archive, ordered by
+            id.
 
-    def sections(self):
-        """ Return a generator for all the sections in the archive. """
-        sections = Section.select()
+            prefetch_cards -- load the cards of the sections beforehand,
+                using a single query for each chunk of sections
+            after_id   -- only obtain the sections whose id is greater
+                than this one
+            limit      -- maximum number of sections to obtain. All of
+                them are obtained if not provided
+            chunk_size -- number of sections fetched from the database at
+                a time
+        """
+        pages = self._keyset_pages(
+            Section.select(), Section.id, chunk_size, after_id, limit)
 
-        for section in sections:
-            yield SectionObj(section)
+        for page in pages:
+            sections = [SectionObj(section) for section in page]
+
+            if prefetch_cards:
+                self._attach_cards(sections)
+
+            for section in sections:
+                yield section
+
+    @_bound
+    def similar_cards(self, cid=0, title="", limit=10, threshold=0):
+        """ Find the cards most similar to a given one.
+
+            cid       -- id of the card
+            title     -- title of the card
+            limit     -- maximum number of cards to obtain
+            threshold -- minimum estimated similarity (from 0 to 1) of the
+                terms of the cards
+
+            Similarity is estimated from the MinHash signatures of the
+            title, description and tags of the cards, and only the cards
+            sharing an LSH bucket with the given one are compared.
+
+            Returns a list of (CardObj, similarity) tuples, most similar
+            first.
+        """
+        try:
+            if not cid:
+                cid = self._id_of(Card.title, title)
+
+        except DoesNotExist:
+            return []
+
+        signature = self._signatures([cid]).get(cid)
+
+        if signature is None or limit < 1:
+            return []
+
+        other = CardBucket.alias()
+        candidates = (CardBucket
+            .select(CardBucket.card)
+            .join(other, on=(CardBucket.bucket == other.bucket))
+            .where(other.card == cid, CardBucket.card != cid)
+            .distinct()
+            .tuples())
+
+        signatures = self._signatures([card for card, in candidates])
+        scored = []
+
+        for card, candidate in signatures.items():
+            score = minhash.similarity(signature, candidate)
+
+            if score >= threshold:
+                _push_bounded(scored, limit, (score, -card))
+
+        scored.sort(reverse=True)
+        scores = dict((-card, score) for score, card in scored)
+        cards = self._cards_by_id([-card for _, card in scored])
+
+        return [(card, scores[card.id]) for card in cards]
+
+    @_bound
+    def tag_counts(self, all_of=(), any_of=(), none_of=(), limit=None):
+        """ Count the cards each tag appears in.
+
+            all_of  -- only count the cards that have all these tags
+            any_of  -- only count the cards that have any of these tags
+            none_of -- only count the cards that have none of these tags
+            limit   -- maximum number of tags to obtain. All of them are
+                obtained if not provided
+
+            Counts are computed by the database in a single aggregate
+            query.
+
+            Returns a list of (tag, count) tuples, most used first.
+        """
+        conditions = self._tag_filter(CardTag.card, all_of, any_of, none_of)
+
+        if conditions is None:
+            return []
+
+        count = fn.COUNT(CardTag.card)
+        query = (CardTag
+            .select(Tag.name, count)
+            .join(Tag)
+            .group_by(Tag.name)
+            .order_by(count.desc(), Tag.name)
+            .tuples())
+
+        if conditions:
+            query = query.where(*conditions)
+
+        if limit:
+            query = query.limit(limit)
+
+        return list(query)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This module contains the caches used by the archive
+
+from __future__ import absolute_import, division
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache(object):
+
+    def __init__(self, size=128, ttl=None):
+        """ Bounded cache that discards the least recently used entries.
+
+            size -- maximum number of entries
+            ttl  -- seconds after which an entry expires, if given
+        """
+        self.size = size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        """ Remove every entry from the cache. """
+        with self._lock:
+            self._data.clear()
+
+    def discard(self, key):
+        """ Remove an entry from the cache, if present. """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def evict(self, predicate):
+        """ Remove the entries whose key satisfies the given predicate. """
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def get(self, key, default=None):
+        """ Obtain an entry from the cache, marking it as recently used.
+
+            Returns the default value if not present or expired.
+        """
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires is not None and expires < time.time():
+                self.misses += 1
+                return default
+
+            # Reinsert as the most recently used entry
+            self._data[key] = (value, expires)
+            self.hits += 1
+
+            return value
+
+    def set(self, key, value):
+        """ Add an entry to the cache, discarding the least recently used
+            one if full.
+        """
+        expires = time.time() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        """ Obtain the usage statistics of the cache.
+
+            Returns a dict with the number of hits, misses and entries, as
+            well as the hit rate.
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._data),
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
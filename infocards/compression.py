@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This module contains the codecs used to compress the content of cards
+
+from __future__ import absolute_import
+import zlib
+from .exceptions import ArchiveConfigException
+
+
+class Codec(object):
+
+    # Name stored along with each compressed content, so that it can be
+    # read whatever the codec used by the archive
+    name = None
+
+    def compress(self, data):
+        """ Compress a string of bytes. """
+        raise NotImplementedError
+
+    def compress_text(self, text):
+        """ Compress a text, encoded in UTF-8. """
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+
+        return self.compress(text)
+
+    def decompress(self, data):
+        """ Decompress a string of bytes. """
+        raise NotImplementedError
+
+    def decompress_text(self, data):
+        """ Decompress a text compressed by compress_text(). """
+        return self.decompress(bytes(data)).decode('utf-8')
+
+
+class ZlibCodec(Codec):
+
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        """ Compress using zlib, from the standard library.
+
+            level -- compression level, from 1 (fastest) to 9 (smallest)
+        """
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class ZstdCodec(Codec):
+
+    name = 'zstd'
+
+    def __init__(self, level=3):
+        """ Compress using zstandard, which is faster than zlib for a
+            similar ratio.
+
+            level -- compression level, from 1 (fastest) to 22 (smallest)
+        """
+        try:
+            import zstandard
+
+        except ImportError:
+            raise ArchiveConfigException('zstandard is not installed')
+
+        self.level = level
+        self._zstd = zstandard
+
+    def compress(self, data):
+        # Compressors cannot be shared between threads
+        return self._zstd.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data):
+        return self._zstd.ZstdDecompressor().decompress(data)
+
+
+# Available codecs by name
+CODECS = {
+    'zlib': ZlibCodec,
+    'zstd': ZstdCodec
+}
+
+
+def get_codec(codec):
+    """ Obtain a codec.
+
+        codec -- either the name of one of the available codecs or a Codec
+            instance, which is returned as is
+    """
+    if isinstance(codec, Codec):
+        return codec
+
+    try:
+        return CODECS[codec]()
+
+    except KeyError:
+        raise ArchiveConfigException('Invalid codec: %s' % codec)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This module contains the helpers used to read and write archive dumps
+#
+# Dumps are newline-delimited JSON files, where each line is a record with
+# a 'type' key. Files ending in '.gz' are compressed using gzip, and those
+# ending in '.zst' using zstandard (if installed).
+
+from __future__ import absolute_import
+from datetime import datetime
+import gzip
+import io
+import json
+from .exceptions import ArchiveOperationException
+
+
+# Version of the dump format
+DUMP_VERSION = 1
+
+
+def format_date(value):
+    """ Convert a datetime to the string stored in the dump. """
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+
+def open_dump(path, mode):
+    """ Open a dump file for reading ('r') or writing ('w').
+
+        The compression is chosen according to the extension of the file.
+
+        Returns a binary file object.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 'b')
+
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+
+        except ImportError:
+            raise ArchiveOperationException('zstandard is not installed')
+
+        f = open(path, mode + 'b')
+
+        if mode == 'w':
+            return zstandard.ZstdCompressor().stream_writer(f)
+
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f))
+
+    return open(path, mode + 'b')
+
+
+def parse_date(value):
+    """ Convert a string stored in the dump to a datetime. """
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+
+
+def read_records(f):
+    """ Read the records of a dump, checking its header.
+
+        Returns a generator of (line number, record) tuples.
+    """
+    lines = enumerate(f, 1)
+
+    for number, line in lines:
+        header = json.loads(line.decode('utf-8'))
+
+        if (header.get('type') != 'infocards' or
+                header.get('version') != DUMP_VERSION):
+            raise ArchiveOperationException('unsupported dump format')
+
+        break
+
+    for number, line in lines:
+        if line.strip():
+            yield number, json.loads(line.decode('utf-8'))
+
+
+def write_record(f, record):
+    """ Write a single record to a dump. """
+    line = json.dumps(record, sort_keys=True, ensure_ascii=False) + '\n'
+    f.write(line.encode('utf-8'))
+
+
+def write_records(f, records):
+    """ Write the header and the given records to a dump.
+
+        Returns the number of records written.
+    """
+    count = 0
+
+    write_record(f, {'type': 'infocards', 'version': DUMP_VERSION})
+
+    for record in records:
+        write_record(f, record)
+        count += 1
+
+    return count
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This module contains the native full-text search structures of each
+# database backend
+
+from __future__ import absolute_import
+import re
+from .exceptions import ArchiveConfigException
+
+
+class FullText(object):
+
+    # Column holding the card id in the full-text query
+    id_column = 'id'
+
+    def __init__(self, db):
+        """ Manage the full-text structure of the card table.
+
+            db -- database the archive is connected to
+        """
+        self.db = db
+
+    def create(self):
+        """ Create the full-text structure if it does not exist yet. """
+        raise NotImplementedError
+
+    def match(self, terms, sid=0):
+        """ Obtain the cards that contain any of the given terms, or a term
+            starting with them, in their title, description or tags.
+
+            terms -- set of query terms
+            sid   -- id of the section to limit the search to
+
+            Returns a list of card ids.
+        """
+        sql, params = self.query(terms)
+
+        if not params:
+            return []
+
+        if sid:
+            sql += (' AND %s IN (SELECT card_id FROM relation'
+                ' WHERE section_id = %s)' % (
+                    self.id_column, self.db.interpolation))
+            params.append(sid)
+
+        return [row[0] for row in self.db.execute_sql(sql, params)]
+
+    def query(self, terms):
+        """ Build the query that obtains the ids of the matching cards.
+
+            Returns a tuple with the SQL and a list of parameters.
+        """
+        raise NotImplementedError
+
+    def _index_names(self):
+        """ Obtain the names of the indexes of the card table. """
+        return [index.name for index in self.db.get_indexes('card')]
+
+
+class SqliteFullText(FullText):
+
+    id_column = 'rowid'
+
+    def create(self):
+        """ Create an FTS5 table that uses the card table as its content.
+
+            Triggers keep it up to date on every change to the cards.
+        """
+        exists = 'card_fts' in self.db.get_tables()
+
+        self.db.execute_sql(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS card_fts USING fts5('
+            'title, "desc", tags, content=\'card\', content_rowid=\'id\')')
+
+        self.db.execute_sql(
+            'CREATE TRIGGER IF NOT EXISTS card_fts_insert '
+            'AFTER INSERT ON card BEGIN '
+            'INSERT INTO card_fts (rowid, title, "desc", tags) '
+            'VALUES (new.id, new.title, new."desc", new.tags); END')
+
+        self.db.execute_sql(
+            'CREATE TRIGGER IF NOT EXISTS card_fts_delete '
+            'AFTER DELETE ON card BEGIN '
+            'INSERT INTO card_fts (card_fts, rowid, title, "desc", tags) '
+            'VALUES (\'delete\', old.id, old.title, old."desc", old.tags); '
+            'END')
+
+        self.db.execute_sql(
+            'CREATE TRIGGER IF NOT EXISTS card_fts_update '
+            'AFTER UPDATE ON card BEGIN '
+            'INSERT INTO card_fts (card_fts, rowid, title, "desc", tags) '
+            'VALUES (\'delete\', old.id, old.title, old."desc", old.tags); '
+            'INSERT INTO card_fts (rowid, title, "desc", tags) '
+            'VALUES (new.id, new.title, new."desc", new.tags); END')
+
+        # Index the cards that were already in the archive
+        if not exists:
+            self.db.execute_sql(
+                'INSERT INTO card_fts (card_fts) VALUES (\'rebuild\')')
+
+    def query(self, terms):
+        match = ' OR '.join(
+            '"%s"*' % t.replace('"', '""') for t in sorted(terms))
+
+        return ('SELECT rowid FROM card_fts WHERE card_fts MATCH ?', [match])
+
+
+class PostgresFullText(FullText):
+
+    # Expression the GIN index is built on, queries must use the same one
+    vector = ("to_tsvector('simple', "
+        "title || ' ' || \"desc\" || ' ' || tags)")
+
+    def create(self):
+        """ Create a GIN index on the tsvector of the cards. """
+        if 'card_fts' in self._index_names():
+            return
+
+        self.db.execute_sql(
+            'CREATE INDEX card_fts ON card USING GIN (%s)' % self.vector)
+
+    def query(self, terms):
+        # Quote every term as a prefix lexeme
+        tsquery = ' | '.join(
+            "'%s':*" % t.replace('\\', '\\\\').replace("'", "''")
+            for t in sorted(terms))
+
+        return ("SELECT id FROM card WHERE %s @@ to_tsquery('simple', %%s)"
+            % self.vector, [tsquery])
+
+
+class MySQLFullText(FullText):
+
+    def create(self):
+        """ Add a FULLTEXT index on the title, description and tags. """
+        if 'card_fts' in self._index_names():
+            return
+
+        self.db.execute_sql(
+            'ALTER TABLE card ADD FULLTEXT INDEX card_fts '
+            '(title, `desc`, tags)')
+
+    def query(self, terms):
+        # Boolean mode operators would change the meaning of the query
+        words = [re.sub(r'[+\-<>()~*"@]', ' ', t) for t in sorted(terms)]
+        against = ' '.join('%s*' % w.strip() for w in words if w.strip())
+
+        if not against:
+            return ('', [])
+
+        return ('SELECT id FROM card WHERE MATCH (title, `desc`, tags) '
+            'AGAINST (%s IN BOOLEAN MODE)', [against])
+
+
+# Full-text structures by database type
+FULLTEXT = {
+    'mysql': MySQLFullText,
+    'postgres': PostgresFullText,
+    'sqlite': SqliteFullText,
+}
+
+
+def get_fulltext(db_type, db):
+    """ Obtain the full-text structure for the given database type. """
+    try:
+        return FULLTEXT[db_type](db)
+
+    except KeyError:
+        raise ArchiveConfigException(
+            'Native search not supported for %s' % db_type)
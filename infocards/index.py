@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This module contains the helpers used to build the search term index
+
+from __future__ import absolute_import, division
+import math
+
+
+# Size of the character n-grams used to find similar terms
+GRAM_SIZE = 2
+
+# Lost n-grams already computed, by (length, likelihood)
+_lost_cache = {}
+
+
+def card_tags(card):
+    """ Obtain the set of normalized tags of a card. """
+    return set(card.tags.lower().split())
+
+
+def card_terms(card, tokenizer):
+    """ Obtain the set of normalized terms of a card.
+
+        These are the terms the search is performed against, taken from the
+        id, title, description and tags of the card.
+    """
+    s_card = "%s %s %s %s" % (str(card.id), card.title, card.desc, card.tags)
+
+    return tokenizer.tokenize(s_card)
+
+
+def chunks(items, size):
+    """ Split an iterable into lists of (at most) the given size.
+
+        Used to keep the number of query parameters within the limits of
+        the database. Items are consumed lazily, so this can be used on
+        generators of any size.
+    """
+    chunk = []
+
+    for item in items:
+        chunk.append(item)
+
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def grams(term):
+    """ Obtain the set of distinct character n-grams of a term. """
+    return set(
+        term[i:i + GRAM_SIZE] for i in range(len(term) - GRAM_SIZE + 1))
+
+
+def lost_grams(length, likelihood):
+    """ Obtain the maximum number of distinct n-grams of a term that may be
+        missing from another term while `fuzz.partial_ratio` still considers
+        them similar.
+
+        length     -- length of the shorter of both terms, which is the
+                one that `partial_ratio` aligns against the longer one
+        likelihood -- percentage for which two terms are considered similar
+
+        The ratio of the shorter term against a window of the longer one is
+        2M / (length + window), where M is the number of matched characters.
+        Every unmatched character of the term breaks at most GRAM_SIZE of its
+        n-grams, and every unmatched character in the window breaks at most
+        GRAM_SIZE - 1 of them, so the worst case among all the windows that
+        reach the likelihood gives an upper bound that never discards a
+        similar term.
+    """
+    key = (length, likelihood)
+
+    if key in _lost_cache:
+        return _lost_cache[key]
+
+    positions = max(0, length - GRAM_SIZE + 1)
+
+    # Every term is similar, nothing can be discarded
+    if likelihood <= 0.5:
+        return positions
+
+    worst = 0
+
+    for matched in range(1, length + 1):
+        # Largest window for which the (rounded) ratio reaches the likelihood
+        window = int(200 * matched / (likelihood - 0.5) + 1e-9) - length
+        window = min(window, length)
+
+        if window < matched:
+            continue
+
+        lost = (GRAM_SIZE * (length - matched) +
+            (GRAM_SIZE - 1) * (window - matched))
+        worst = max(worst, lost)
+
+    _lost_cache[key] = min(worst, positions)
+
+    return _lost_cache[key]
+
+
+def lost_ratio(length, likelihood):
+    """ Obtain the maximum number of lost n-grams per thousand characters
+        among the terms shorter than the given length.
+
+        Multiplied by the length of a shorter term, it gives a bound that
+        can be checked by the database itself using integers only.
+    """
+    ratios = [lost_grams(n, likelihood) / n for n in range(1, length)]
+
+    return int(math.ceil(max(ratios) * 1000)) if ratios else 0
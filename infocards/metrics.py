@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This module contains the instrumentation of the operations of the archive
+
+from __future__ import absolute_import, division
+import threading
+import time
+from .exceptions import ArchiveConfigException
+
+
+# Calls being measured in each thread, innermost last
+_local = threading.local()
+
+
+def _active():
+    """ Obtain the calls being measured in the current thread. """
+    return _local.__dict__.setdefault('calls', [])
+
+
+def count(name, amount=1):
+    """ Increase a counter of the innermost call being measured in the
+        current thread, if any.
+    """
+    calls = _local.__dict__.get('calls')
+
+    if calls:
+        counters = calls[-1].counters
+        counters[name] = counters.get(name, 0) + amount
+
+
+def instrument(db):
+    """ Measure the queries executed through a database.
+
+        Each query is accounted to every call being measured in the thread
+        that executes it. Only the execution of the query is measured, not
+        the fetching of its rows.
+    """
+    execute = db.execute_sql
+
+    def execute_sql(*args, **kwargs):
+        calls = _local.__dict__.get('calls')
+
+        if not calls:
+            return execute(*args, **kwargs)
+
+        start = time.time()
+
+        try:
+            return execute(*args, **kwargs)
+
+        finally:
+            elapsed = time.time() - start
+
+            for call in calls:
+                call.queries += 1
+                call.query_seconds += elapsed
+
+    db.execute_sql = execute_sql
+
+
+class Call(object):
+
+    __slots__ = ('method', 'seconds', 'queries', 'query_seconds',
+        'counters', '_start')
+
+    def __init__(self, method):
+        """ Measurements of a call to a method of the archive.
+
+            Generators are measured while they are running only, and the
+            call is recorded once they finish.
+
+            method        -- name of the method
+            seconds       -- time spent in the method
+            queries       -- number of queries executed
+            query_seconds -- time spent executing queries
+            counters      -- dict of counters specific to the method
+        """
+        self.method = method
+        self.seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.counters = {}
+
+        self._start = None
+
+    def pause(self):
+        """ Stop measuring the call. """
+        self.seconds += time.time() - self._start
+        _active().remove(self)
+
+    def resume(self):
+        """ Start measuring the call in the current thread. """
+        _active().append(self)
+        self._start = time.time()
+
+
+class Sink(object):
+
+    def record(self, call):
+        """ Receive the measurements of a finished call.
+
+            call -- Call instance
+        """
+        raise NotImplementedError
+
+
+class CallbackSink(Sink):
+
+    def __init__(self, callback):
+        """ Pass every finished call to a function. """
+        self.callback = callback
+
+    def record(self, call):
+        self.callback(call)
+
+
+class Stats(Sink):
+
+    # Upper bounds, in seconds, of the buckets of the latency histograms
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self, buckets=BUCKETS):
+        """ Aggregate the calls of each method in memory.
+
+            buckets -- upper bounds, in seconds, of the buckets of the
+                latency histograms. Calls slower than the last one are
+                counted in an additional bucket
+        """
+        self.buckets = tuple(sorted(buckets))
+
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def record(self, call):
+        with self._lock:
+            stats = self._methods.get(call.method)
+
+            if stats is None:
+                stats = self._methods[call.method] = {
+                    'calls': 0,
+                    'seconds': 0.0,
+                    'max_seconds': 0.0,
+                    'histogram': [0] * (len(self.buckets) + 1),
+                    'queries': 0,
+                    'query_seconds': 0.0,
+                    'counters': {}
+                }
+
+            stats['calls'] += 1
+            stats['seconds'] += call.seconds
+            stats['max_seconds'] = max(stats['max_seconds'], call.seconds)
+            stats['queries'] += call.queries
+            stats['query_seconds'] += call.query_seconds
+
+            bucket = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if call.seconds <= bound:
+                    bucket = i
+                    break
+
+            stats['histogram'][bucket] += 1
+
+            counters = stats['counters']
+            for name, amount in call.counters.items():
+                counters[name] = counters.get(name, 0) + amount
+
+    def reset(self):
+        """ Discard every measurement. """
+        with self._lock:
+            self._methods.clear()
+
+    def snapshot(self):
+        """ Obtain the measurements of each method.
+
+            Returns a dict mapping the name of each method to a dict with
+            the number of calls, the total, mean and maximum seconds, the
+            latency histogram as a list of (upper bound, calls) tuples (the
+            last bound being None), the number of queries and the seconds
+            spent executing them, and the counters of the method.
+        """
+        bounds = list(self.buckets) + [None]
+
+        with self._lock:
+            snapshot = {}
+
+            for method, stats in self._methods.items():
+                snapshot[method] = dict(
+                    stats,
+                    mean_seconds=stats['seconds'] / stats['calls'],
+                    histogram=list(zip(bounds, stats['histogram'])),
+                    counters=dict(stats['counters']))
+
+            return snapshot
+
+
+def get_sink(sink):
+    """ Obtain the sink to record the calls to.
+
+        sink -- either None (no instrumentation), a Sink instance, which is
+            returned as is, or a function receiving each Call
+    """
+    if sink is None or isinstance(sink, Sink):
+        return sink
+
+    if callable(sink):
+        return CallbackSink(sink)
+
+    raise ArchiveConfigException('Invalid metrics sink: %r' % sink)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This module contains the MinHash signatures used to find similar cards.
+# Hashes are derived from SHA-512 and MD5 rather than hash(), so that the
+# signatures stored in an archive are the same in every process and
+# version of Python
+
+from __future__ import absolute_import, division
+import hashlib
+import struct
+
+
+# Number of hash functions of each signature
+NUM_HASHES = 64
+
+# Number of bands the signatures are split into. Two cards share a bucket
+# if all the hashes of any band are equal, which mostly happens above a
+# similarity of (1 / BANDS) ** (BANDS / NUM_HASHES), about 0.5
+BANDS = 16
+
+# Each SHA-512 digest provides 16 of the hashes of a term
+_SALTS = [('%d:' % i).encode('ascii') for i in range(NUM_HASHES // 16)]
+
+
+def _digest(text, bits):
+    """ Obtain a stable hash of a text with the given number of bits. """
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+
+    return int(hashlib.md5(text).hexdigest(), 16) >> (128 - bits)
+
+
+def _hashes(term):
+    """ Obtain the NUM_HASHES independent 32-bit hashes of a term. """
+    if not isinstance(term, bytes):
+        term = term.encode('utf-8')
+
+    hashes = []
+
+    for salt in _SALTS:
+        hashes.extend(
+            struct.unpack('<16I', hashlib.sha512(salt + term).digest()))
+
+    return hashes
+
+
+def buckets(signature):
+    """ Obtain the LSH bucket of each band of a signature.
+
+        The band is hashed along with its hashes, so that buckets of
+        different bands never collide.
+
+        Returns a list of 60-bit integers.
+    """
+    rows = NUM_HASHES // BANDS
+
+    return [
+        _digest('%d:%s' % (band, ','.join(
+            str(h) for h in signature[band * rows:(band + 1) * rows])), 60)
+        for band in range(BANDS)]
+
+
+def pack(signature):
+    """ Convert a signature to bytes, in order to store it. """
+    return struct.pack('<%dI' % NUM_HASHES, *signature)
+
+
+def signature(terms):
+    """ Obtain the MinHash signature of a set of terms.
+
+        Returns a list of NUM_HASHES integers, or None if there are no
+        terms.
+    """
+    hashes = [_hashes(term) for term in terms]
+
+    if not hashes:
+        return None
+
+    return [min(column) for column in zip(*hashes)]
+
+
+def similarity(first, second):
+    """ Estimate the Jaccard similarity of the sets of terms of two
+        signatures, as the fraction of equal hashes.
+    """
+    return sum(1 for a, b in zip(first, second) if a == b) / NUM_HASHES
+
+
+def unpack(data):
+    """ Convert a stored signature back to a list. """
+    return list(struct.unpack('<%dI' % NUM_HASHES, bytes(data)))
@@ -19,11 +19,58 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+from contextlib import contextmanager
+import threading
 from peewee import *
+from .compression import get_codec
+
+
+class DatabaseProxy(Proxy):
+    """ Proxy to the database of the archive in use by the current thread.
+
+        Archives bind their own database while their methods run, so that
+        several archives can be used concurrently from the same process.
+        Otherwise, the database given to `initialize()` is used.
+    """
+
+    __slots__ = ['obj', '_callbacks', '_local']
+
+    def __init__(self):
+        self._local = threading.local()
+        super(DatabaseProxy, self).__init__()
+
+    def __getattr__(self, attr):
+        db = self.current()
+
+        if db is None:
+            raise AttributeError('Cannot use uninitialized Proxy.')
+
+        return getattr(db, attr)
+
+    @contextmanager
+    def bind(self, db):
+        """ Use a database in the current thread within the context. """
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(db)
+
+        try:
+            yield db
+
+        finally:
+            stack.pop()
+
+    def current(self):
+        """ Obtain the database in use by the current thread, if any. """
+        stack = self._local.__dict__.get('stack')
+
+        if stack and stack[-1] is not None:
+            return stack[-1]
+
+        return self.obj
 
 
 # Database information can only be known at run-time
-_db_proxy = Proxy()
+_db_proxy = DatabaseProxy()
 
 class BaseModel(Model):
     class Meta:
@@ -35,42 +82,125 @@ class Card(BaseModel):
     desc = CharField()
     content = TextField()
     tags = CharField()
-    modified = DateTimeField()
+    modified = DateTimeField(index=True)
     modified_by = CharField()
 
 
-class CardObj(object):
+# Columns needed to list cards, leaving out their (potentially large) content
+_LISTING = (
+    Card.id, Card.title, Card.desc, Card.tags, Card.modified, Card.modified_by)
+
+# Marks the content of a card that has not been fetched yet
+_NOT_LOADED = object()
+
+
+class _RowObj(object):
+    """ Base of the objects handed out by the archive in place of rows.
+
+        The database they were obtained from is not pickled (nor copied),
+        the one in use when unpickling being used instead.
+    """
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        return dict(
+            (slot, getattr(self, slot)) for slot in self.__slots__
+            if slot != '_db' and getattr(self, slot) is not _NOT_LOADED)
+
+    def __setstate__(self, state):
+        for slot in self.__slots__:
+            setattr(self, slot, state.get(slot, _NOT_LOADED))
+
+        self._db = _db_proxy.current()
+
+
+class CardObj(_RowObj):
+
+    __slots__ = ('id', 'title', 'desc', '_content', 'tags', 'modified',
+        'modified_by', '_sections', '_db')
 
     def __init__(self, card):
         """ Create a dummy card object in order to prevent
             modifications in the database from outside the
             archive.
+
+            The content of the card is only fetched from the database
+            when accessed, unless it was already selected along with
+            the rest of the card. Content stored apart from the card
+            leaves it empty, so empty content is also fetched.
         """
         self.id = card.id
         self.title = card.title
         self.desc = card.desc
-        self.content = card.content
+        self._content = card._data.get('content') or _NOT_LOADED
         self.tags = card.tags
         self.modified = card.modified
         self.modified_by = card.modified_by
 
+        # Database the card was obtained from
+        self._db = _db_proxy.current()
+
+        # Sections loaded beforehand by the archive, if any
+        self._sections = None
+
+    @property
+    def content(self):
+        """ Main content of the card, fetched on first access. """
+        if self._content is _NOT_LOADED:
+            with _db_proxy.bind(self._db):
+                content, codec, data = (Card
+                    .select(Card.content, CardContent.codec, CardContent.data)
+                    .join(CardContent, JOIN_LEFT_OUTER)
+                    .where(Card.id == self.id)
+                    .tuples()
+                    .first()) or (None, None, None)
+
+            if codec is not None:
+                content = get_codec(codec).decompress_text(data)
+
+            self._content = content
+
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+
     def sections(self):
         """ Get all the the sections this card appears in. """
-        sections = (Section
-            .select()
-            .join(Relation)
-            .join(Card)
-            .where(Card.id == self.id))
+        if self._sections is not None:
+            for section in self._sections:
+                yield section
+
+            return
+
+        with _db_proxy.bind(self._db):
+            sections = (Section
+                .select()
+                .join(Relation)
+                .join(Card)
+                .where(Card.id == self.id))
+
+            sections = [SectionObj(section) for section in sections]
 
         for section in sections:
-            yield SectionObj(section)
+            yield section
+
+
+class CardContent(BaseModel):
+    card = ForeignKeyField(Card, primary_key=True)
+    codec = CharField()
+    data = BlobField()
 
 
 class Section(BaseModel):
     name = CharField(unique=True)
 
 
-class SectionObj(object):
+class SectionObj(_RowObj):
+
+    __slots__ = ('id', 'name', '_cards', '_db')
 
     def __init__(self, section):
         """ Create a dummy section object in order to prevent
@@ -80,16 +210,31 @@ class SectionObj(object):
         self.id = section.id
         self.name = section.name
 
+        # Database the section was obtained from
+        self._db = _db_proxy.current()
+
+        # Cards loaded beforehand by the archive, if any
+        self._cards = None
+
     def cards(self):
         """ Get all the cards in the section. """
-        cards = (Card
-            .select()
-            .join(Relation)
-            .join(Section)
-            .where(Section.id == self.id))
+        if self._cards is not None:
+            for card in self._cards:
+                yield card
+
+            return
+
+        with _db_proxy.bind(self._db):
+            cards = (Card
+                .select(*_LISTING)
+                .join(Relation)
+                .join(Section)
+                .where(Section.id == self.id))
+
+            cards = [CardObj(card) for card in cards]
 
         for card in cards:
-            yield CardObj(card)
+            yield card
 
 
 class Relation(BaseModel):
@@ -98,3 +243,94 @@ class Relation(BaseModel):
 
     class Meta:
         primary_key = CompositeKey('section', 'card')
+
+        # Sections of a card are obtained without reading the table
+        indexes = (
+            (('card', 'section'), True),
+        )
+
+
+class Tag(BaseModel):
+    name = CharField(unique=True)
+
+
+class CardTag(BaseModel):
+    tag = ForeignKeyField(Tag)
+    card = ForeignKeyField(Card)
+
+    class Meta:
+        primary_key = CompositeKey('tag', 'card')
+
+
+class CardSignature(BaseModel):
+    card = ForeignKeyField(Card, primary_key=True)
+    signature = BlobField()
+
+
+class CardBucket(BaseModel):
+    bucket = BigIntegerField()
+    card = ForeignKeyField(Card)
+
+    class Meta:
+        primary_key = CompositeKey('bucket', 'card')
+
+
+class Change(BaseModel):
+    kind = CharField()
+    action = CharField()
+    card = IntegerField(null=True)
+    section = IntegerField(null=True)
+    changed = DateTimeField()
+
+
+class ChangeObj(object):
+
+    __slots__ = ('seq', 'kind', 'action', 'card', 'section', 'changed')
+
+    def __init__(self, change):
+        """ Create a dummy change object in order to prevent
+            modifications in the database from outside the
+            archive.
+
+            The sequence number of the change is its id. Transactions
+            recording changes are serialized, so changes become visible
+            in the order of their sequence numbers.
+        """
+        self.seq = change.id
+        self.kind = change.kind
+        self.action = change.action
+        self.card = change.card
+        self.section = change.section
+        self.changed = change.changed
+
+
+class Setting(BaseModel):
+    name = CharField(unique=True)
+    value = TextField()
+
+
+class Term(BaseModel):
+    term = CharField(unique=True)
+    length = IntegerField(index=True)
+    grams = IntegerField()
+
+
+class CardTerm(BaseModel):
+    term = ForeignKeyField(Term)
+    card = ForeignKeyField(Card)
+
+    class Meta:
+        primary_key = CompositeKey('term', 'card')
+
+
+class TermGram(BaseModel):
+    gram = CharField()
+    term = ForeignKeyField(Term)
+
+    class Meta:
+        primary_key = CompositeKey('gram', 'term')
+
+
+# Models of every table of the archive
+MODELS = (Card, Section, Relation, Term, CardTerm, TermGram, Tag, CardTag,
+    Setting, Change, CardContent, CardSignature, CardBucket)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This module contains the versioning and migrations of the database schema
+
+from __future__ import absolute_import
+from .models import Card, CardBucket, CardContent, CardSignature, Change
+from .models import Relation, Setting
+
+
+def _card_signatures(db):
+    """ Create the tables of the signatures of the cards, which are
+        computed by rebuilding the index of the archive.
+    """
+    db.create_tables([CardSignature, CardBucket], True)
+
+    return True
+
+
+def _change_lock(db):
+    """ Add the setting locked while recording changes, so that changes
+        are committed in the order of their sequence numbers.
+    """
+    set_setting('change_lock', '0')
+
+
+def _change_log(db):
+    """ Create the table of the change log, which starts empty as the
+        previous changes are not known.
+    """
+    db.create_tables([Change], True)
+
+
+def _content_table(db):
+    """ Create the table of the contents stored apart from their cards.
+        Existing contents are left in the cards until compacted.
+    """
+    db.create_tables([CardContent], True)
+
+
+def _ensure_index(db, model, fields, unique=False):
+    """ Create an index unless the table already has one on the same
+        columns.
+    """
+    columns = [field.db_column for field in fields]
+    indexes = db.get_indexes(model._meta.db_table)
+
+    if not any(list(index.columns) == columns for index in indexes):
+        db.create_index(model, fields, unique)
+
+
+def _secondary_indexes(db):
+    """ Add the indexes on the modification date of the cards and on the
+        sections of each card.
+    """
+    _ensure_index(db, Card, [Card.modified])
+    _ensure_index(db, Relation, [Relation.card, Relation.section], True)
+
+
+def _tag_index(db):
+    """ Fill the tag tables from the tags of the cards, which is done by
+        rebuilding the index of the archive.
+    """
+    return True
+
+
+# Version of the schema created by this version of the library
+SCHEMA_VERSION = 6
+
+# Functions bringing the schema from the previous version to each version.
+# They return True if the archive needs to be reindexed afterwards
+MIGRATIONS = (
+    (1, _secondary_indexes),
+    (2, _tag_index),
+    (3, _change_log),
+    (4, _content_table),
+    (5, _card_signatures),
+    (6, _change_lock),
+)
+
+
+def get_setting(name, default=None):
+    """ Obtain the value of a setting of the archive. """
+    try:
+        return Setting.get(Setting.name == name).value
+
+    except Setting.DoesNotExist:
+        return default
+
+
+def lock_setting(name):
+    """ Lock the row of a setting until the current transaction ends,
+        making other transactions that lock it wait until then.
+    """
+    (Setting
+        .update(value=Setting.value)
+        .where(Setting.name == name)
+        .execute())
+
+
+def set_setting(name, value):
+    """ Store the value of a setting of the archive. """
+    updated = (Setting
+        .update(value=value)
+        .where(Setting.name == name)
+        .execute())
+
+    if not updated:
+        Setting.create(name=name, value=value)
+
+
+def upgrade(db, created):
+    """ Apply the pending migrations to the schema of an archive.
+
+        db      -- database of the archive
+        created -- whether the tables were just created, in which case
+            they are already up to date
+
+        Returns True if the archive needs to be reindexed.
+    """
+    if created:
+        set_setting('schema_version', str(SCHEMA_VERSION))
+        _change_lock(db)
+        return False
+
+    version = int(get_setting('schema_version', 0))
+    reindex = False
+
+    for target, migration in MIGRATIONS:
+        if target <= version:
+            continue
+
+        with db.atomic():
+            reindex = migration(db) or reindex
+            set_setting('schema_version', str(target))
+
+    return reindex
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This module contains the backends used to score terms when searching
+
+from __future__ import absolute_import
+from fuzzywuzzy import fuzz
+from .exceptions import ArchiveConfigException
+
+
+class Scorer(object):
+
+    def score(self, s_term, terms, likelihood):
+        """ Compare a query term against a block of terms.
+
+            s_term     -- query term
+            terms      -- list of terms to compare the query term against
+            likelihood -- percentage for which two terms are considered
+                    similar. Backends may report any score below it as 0
+
+            Returns a list with the similarity percentage of each term.
+        """
+        raise NotImplementedError
+
+
+class FuzzyScorer(Scorer):
+
+    def score(self, s_term, terms, likelihood):
+        """ Compare the terms one by one using fuzzywuzzy.
+
+            This is the reference implementation.
+        """
+        return [fuzz.partial_ratio(s_term, term) for term in terms]
+
+
+class RapidFuzzScorer(Scorer):
+
+    def __init__(self):
+        """ Compare the terms in a single batch using rapidfuzz.
+
+            The whole block is processed natively, instead of calling the
+            scorer once per term.
+        """
+        try:
+            from rapidfuzz import fuzz, process
+
+        except ImportError:
+            raise ArchiveConfigException('rapidfuzz is not installed')
+
+        self._scorer = fuzz.partial_ratio
+        self._process = process
+
+    def score(self, s_term, terms, likelihood):
+        scores = [0] * len(terms)
+
+        matches = self._process.extract(
+            s_term, terms,
+            scorer=self._scorer,
+            score_cutoff=likelihood,
+            limit=None)
+
+        for _, score, index in matches:
+            scores[index] = score
+
+        return scores
+
+
+# Available backends by name
+SCORERS = {
+    'fuzzywuzzy': FuzzyScorer,
+    'rapidfuzz': RapidFuzzScorer,
+}
+
+
+def get_scorer(scorer):
+    """ Obtain a scoring backend.
+
+        scorer -- either the name of one of the available backends or a
+            Scorer instance, which is returned as is
+    """
+    if isinstance(scorer, Scorer):
+        return scorer
+
+    try:
+        return SCORERS[scorer]()
+
+    except KeyError:
+        raise ArchiveConfigException('Invalid scorer: %s' % scorer)
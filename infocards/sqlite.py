@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This module contains the SQLite specific configuration of the archive
+
+from __future__ import absolute_import
+from peewee import SqliteDatabase
+
+
+# Pragmas applied in the performance mode: readers do not block the writer,
+# commits are not synced to disk until checkpoints (which is still safe in
+# WAL mode), and reads are served from a larger page cache and from a
+# memory-mapped view of the database file
+PERFORMANCE_PRAGMAS = (
+    ('journal_mode', 'wal'),
+    ('synchronous', 'normal'),
+    ('cache_size', -64000),
+    ('mmap_size', 268435456),
+    ('temp_store', 'memory'),
+    ('busy_timeout', 5000),
+)
+
+
+def merge_pragmas(base, extra):
+    """ Override the values of a sequence of pragmas.
+
+        base  -- sequence of (name, value) tuples
+        extra -- dict or sequence of (name, value) tuples overriding the
+            base ones, or added after them
+
+        Returns a list of (name, value) tuples, keeping their order.
+    """
+    extra = dict(extra)
+    pragmas = [(name, extra.pop(name, value)) for name, value in base]
+
+    return pragmas + sorted(extra.items())
+
+
+class TunedSqliteDatabase(SqliteDatabase):
+
+    def __init__(self, database, pragmas=(), read_only=False, **kwargs):
+        """ SQLite database that configures every new connection.
+
+            pragmas   -- sequence of (name, value) tuples to apply
+            read_only -- whether to reject any write to the database
+        """
+        self.pragmas = list(pragmas)
+        self.read_only = read_only
+
+        super(TunedSqliteDatabase, self).__init__(database, **kwargs)
+
+    def _add_conn_hooks(self, conn):
+        super(TunedSqliteDatabase, self)._add_conn_hooks(conn)
+
+        cursor = conn.cursor()
+
+        for name, value in self.pragmas:
+            cursor.execute('PRAGMA %s = %s;' % (name, value))
+
+        if self.read_only:
+            cursor.execute('PRAGMA query_only = ON;')
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This module contains the tokenizers used to split text into search terms
+
+from __future__ import absolute_import
+import unicodedata
+from .exceptions import ArchiveConfigException
+
+
+class Tokenizer(object):
+
+    # Name stored in the archive, so that it is reindexed when the
+    # tokenizer changes
+    name = None
+
+    def normalize(self, term):
+        """ Obtain the normalized form of a term. """
+        raise NotImplementedError
+
+    def tokenize(self, text):
+        """ Split a text into a set of normalized terms. """
+        return set([self.normalize(term) for term in text.split()])
+
+
+class SimpleTokenizer(Tokenizer):
+
+    name = 'simple'
+
+    def normalize(self, term):
+        """ Terms are only lowercased. """
+        return term.lower()
+
+
+class UnicodeTokenizer(Tokenizer):
+
+    name = 'unicode'
+
+    def normalize(self, term):
+        """ Terms are case folded and stripped of accents, so that, for
+            instance, 'Café' and 'CAFE' are the same term.
+
+            Text must be unicode in Python 2.
+        """
+        term = unicodedata.normalize('NFKD', term)
+        term = ''.join([c for c in term if not unicodedata.combining(c)])
+
+        # Python 2 strings cannot be case folded
+        if hasattr(term, 'casefold'):
+            return term.casefold()
+
+        return term.lower()
+
+
+# Available tokenizers by name
+TOKENIZERS = {
+    'simple': SimpleTokenizer,
+    'unicode': UnicodeTokenizer
+}
+
+
+def get_tokenizer(tokenizer):
+    """ Obtain a tokenizer.
+
+        tokenizer -- either the name of one of the available tokenizers or
+            a Tokenizer instance, which is returned as is
+    """
+    if isinstance(tokenizer, Tokenizer):
+        return tokenizer
+
+    try:
+        return TOKENIZERS[tokenizer]()
+
+    except KeyError:
+        raise ArchiveConfigException('Invalid tokenizer: %s' % tokenizer)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Simple information card archive library
+# https://github.com/rmed/infocards
+#
+# Copyright (C) 2015  Rafael Medina García <rafamedgar@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Regression tests of the n-gram prefilter of the search term index, which
+# must never discard a term that `fuzz.partial_ratio` considers similar.
+#
+# Run `python -m unittest discover tests` from the root of the repository.
+
+from __future__ import absolute_import, division
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from fuzzywuzzy import fuzz
+from infocards.archive import Archive
+from infocards.index import GRAM_SIZE, card_terms, lost_grams
+from infocards.models import _db_proxy, Term
+
+
+# Likelihoods compared, including those for which every term is similar
+LIKELIHOODS = (0, 30, 50, 51, 60, 70, 75, 80, 85, 90, 95, 100)
+
+# Small alphabet, so that terms share many n-grams without being equal
+ALPHABET = 'abcde'
+
+
+def _word(rnd, length):
+    """ Generate a random term of the given length. """
+    return ''.join(rnd.choice(ALPHABET) for _ in range(length))
+
+
+class PrefilterTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rnd = random.Random(0)
+
+        cls.path = tempfile.mkdtemp()
+        cls.archive = Archive(
+            db_type='sqlite', db_name=os.path.join(cls.path, 'test.db'))
+
+        cards = []
+
+        for i in range(60):
+            words = [_word(rnd, rnd.randint(1, 10)) for _ in range(5)]
+            cards.append({
+                'title': 'card %d' % i,
+                'desc': ' '.join(words),
+                'content': '',
+                'tags': ''
+            })
+
+        cls.archive.bulk_new_cards(cards)
+
+        with _db_proxy.bind(cls.archive.db):
+            cls.vocabulary = dict(Term.select(Term.id, Term.term).tuples())
+
+        # Terms of each card, as indexed by the archive
+        cls.card_terms = dict(
+            (card.id, set(card_terms(card, cls.archive.tokenizer)))
+            for card in cls.archive.cards())
+
+        cls.queries = [_word(rnd, length) for length in range(1, 13)]
+        cls.queries += [_word(rnd, rnd.randint(1, 12)) for _ in range(12)]
+
+        # Similar terms already found, by (query term, likelihood)
+        cls.similar = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.archive.close()
+        shutil.rmtree(cls.path, ignore_errors=True)
+
+    def _similar(self, s_term, likelihood):
+        """ Find the similar terms by comparing the whole vocabulary. """
+        key = (s_term, likelihood)
+
+        if key not in self.similar:
+            self.similar[key] = set(
+                term for term in self.vocabulary.values()
+                if fuzz.partial_ratio(s_term, term) >= likelihood)
+
+        return self.similar[key]
+
+    def test_lost_grams_bounded(self):
+        """ No more n-grams can be lost than a term has. """
+        for length in range(1, 20):
+            positions = max(0, length - GRAM_SIZE + 1)
+
+            for likelihood in LIKELIHOODS:
+                lost = lost_grams(length, likelihood)
+
+                self.assertTrue(0 <= lost <= positions)
+
+    def test_match_terms(self):
+        """ The terms matched through the index are those a full scan of
+            the vocabulary finds.
+        """
+        with _db_proxy.bind(self.archive.db):
+            for likelihood in LIKELIHOODS:
+                for s_term in self.queries:
+                    matches = self.archive._match_terms([s_term], likelihood)
+                    found = set(
+                        self.vocabulary[tid] for tid in matches[s_term])
+
+                    self.assertEqual(
+                        found, self._similar(s_term, likelihood),
+                        'query %r, likelihood %d' % (s_term, likelihood))
+
+    def test_search(self):
+        """ The cards found by a search are those a full scan of the terms
+            of every card finds.
+        """
+        rnd = random.Random(1)
+
+        for likelihood in LIKELIHOODS:
+            for _ in range(10):
+                search_terms = rnd.sample(self.queries, 2)
+                similar = [
+                    self._similar(s_term, likelihood)
+                    for s_term in search_terms]
+
+                expected = set(
+                    cid for cid, terms in self.card_terms.items()
+                    if any(terms & s for s in similar))
+
+                found = set(
+                    card.id for card in self.archive.search(
+                        ' '.join(search_terms), likelihood=likelihood))
+
+                self.assertEqual(
+                    found, expected,
+                    'query %r, likelihood %d' % (search_terms, likelihood))
+
+
+if __name__ == '__main__':
+    unittest.main()